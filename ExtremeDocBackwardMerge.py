@@ -1,23 +1,70 @@
-import re
+import argparse
 
-extremeOrNegativeCommentRegex = re.compile(r'^\s*#[E|N] ')
+from ExtremeDocCache import BuildCache, ChangedOutputFile, makeFingerprint
+from ExtremeDocSnapshot import BaseSnapshots
+from ExtremeDocForwardMerge import readExtremelyCommentedLines, checkNoMergeBlockHeaders, UnreviewedMergeError
+from ExtremeDocComments import commentClassifierForFile
+from ExtremeDocTiming import span, addTimingArguments, startTiming
 
-def isExtremeOrNegativeComment(line):
-    return extremeOrNegativeCommentRegex.match(line)
-
-def copyFileFiltered(inputFileName, outputFileName, linesToRemoveFilter):
+# Copy the input file without its extreme and negative comment lines (as classified by commentClassifier)
+# Returns True if the output file was changed
+def copyFileFiltered(inputFileName, outputFileName, commentClassifier):
     print("Copying filtered lines from %r to %r ..." % (inputFileName, outputFileName))
-    with open(inputFileName, 'r') as inputFile:
-        with open(outputFileName, 'w') as outputFile:
-            for line in inputFile:
-                if not linesToRemoveFilter(line):
-                    print("line = %r" % line)
-                    outputFile.write(line)
+    with span("read"), open(inputFileName, 'r') as inputFile:
+        text = inputFile.read()
+    with span("classify"):
+        codeText = commentClassifier.codeLinesText(text)
+    outputFile = ChangedOutputFile(outputFileName)
+    with span("write"), outputFile as outFile:
+        outFile.write(codeText)
+    return outputFile.changed
+
+def backwardMergeFingerprint(commentClassifier):
+    return makeFingerprint("backward", commentClassifier.regex.pattern)
+
+# Once the main source has been copied from the commented source, the two are in sync,
+# so the main source becomes the base for the next three-way forward merge
+def recordBase(commentedFileName, mainFileName, baseSnapshots):
+    mainSourceLines = readExtremelyCommentedLines(mainFileName, commentClassifierForFile(commentedFileName))
+    baseSnapshots.recordBase(commentedFileName, mainFileName, mainSourceLines.getUncommentedLines())
+
+# Backward merge, skipped if the commented input is unchanged since the last recorded merge into outputFileName
+# (returns True or False according to whether outputFileName changed, or None if the merge was skipped).
+# Raises UnreviewedMergeError if the input still has merge block headers from a forward merge.
+def copyFileFilteredIfChanged(inputFileName, outputFileName, buildCache = None, baseSnapshots = None):
+    checkNoMergeBlockHeaders(inputFileName)
+    commentClassifier = commentClassifierForFile(inputFileName)
+    fingerprint = backwardMergeFingerprint(commentClassifier)
+    if buildCache is not None and buildCache.isUpToDate(outputFileName, [inputFileName], fingerprint):
+        print(" %s is up to date." % outputFileName)
+        if baseSnapshots is not None and not baseSnapshots.hasBase(inputFileName):
+            recordBase(inputFileName, outputFileName, baseSnapshots)
+        return None
+    changed = copyFileFiltered(inputFileName, outputFileName, commentClassifier)
+    if buildCache is not None:
+        buildCache.record(outputFileName, [inputFileName], fingerprint)
+    if baseSnapshots is not None:
+        recordBase(inputFileName, outputFileName, baseSnapshots)
+    return changed
 
 def main():
+    argParser = argparse.ArgumentParser(description = "Copy the extremely commented source back to the main source, without the extreme comments")
+    argParser.add_argument("--no-cache", action = "store_true", help = "always copy, even if the input is unchanged")
+    argParser.add_argument("--no-base", action = "store_true", help = "don't record a base for three-way forward merges")
+    addTimingArguments(argParser)
+    args = argParser.parse_args()
+    startTiming(args)
+    buildCache = None if args.no_cache else BuildCache()
+    baseSnapshots = None if args.no_base else BaseSnapshots()
+
     inputFileName = "ed/ExtremeDocHighlighting.py"
     outputFileName = "ExtremeDocHighlighting.py"
-    copyFileFiltered(inputFileName, outputFileName, isExtremeOrNegativeComment)
+    try:
+        copyFileFilteredIfChanged(inputFileName, outputFileName, buildCache, baseSnapshots)
+    except UnreviewedMergeError as exception:
+        print(" not copying %s back: %s" % (inputFileName, exception))
+    if buildCache is not None:
+        buildCache.save()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,290 @@
+import os, sys, io, json, time, random, platform, tempfile, tracemalloc
+import argparse
+from contextlib import redirect_stdout
+
+from ExtremeDocCache import ChangedOutputFile, TOOL_VERSION
+from ExtremeDocComments import CODE, commentClassifierForFile
+from ExtremeDocDiff import diffEngines, getDiffEngine, DEFAULT_DIFF_ENGINE_NAME
+from ExtremeDocForwardMerge import readExtremelyCommentedLines
+from ExtremeDocBackwardMerge import copyFileFiltered
+from ExtremeDocHighlighting import process
+from ExtremeDocTiming import addTimingArguments, startTiming
+
+# Benchmarks of the main stages of the tools, on synthetic extremely commented sources of increasing size,
+# generated from seed files by repeating their code lines (with each copy made distinct), adding comment lines
+# (taken from the seed's own comments) at a given density, and then editing a copy of the code lines
+# (changed, inserted, deleted and moved lines) to give a new main source to merge forward.
+#
+# Each stage is timed separately (the best of a number of runs), and then run once more with tracemalloc on,
+# to find the peak memory it allocates. The results are written to a JSON file, which can be compared with
+# the results of an earlier run (e.g. before a change) with --compare.
+
+DEFAULT_SEED_FILES = ["synqa.rb", os.path.join("ed", "ExtremeDocHighlighting.py")]
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DEFAULT_RESULTS_FILE_NAME = "extreme-doc-benchmark.json"
+
+STAGES = ["readExtremelyCommentedLines", "mergeForwardTo", "copyFileFiltered", "process"]
+
+EDIT_PATTERNS = ["scattered", "clustered"]
+
+# The code lines and the comment lines (without their indentation) of a seed file
+def readSeed(fileName):
+    with open(fileName, "r") as seedFile:
+        text = seedFile.read()
+    lines, kinds = commentClassifierForFile(fileName, text).classifyLines(text)
+    codeLines = [line for line, kind in zip(lines, kinds) if kind == CODE]
+    commentLines = [line.lstrip() for line, kind in zip(lines, kinds) if kind != CODE]
+    return codeLines, commentLines
+
+def indentation(line):
+    return line[:len(line) - len(line.lstrip())]
+
+# numLines lines of extremely commented source: copies of the seed's code lines, with each non-trivial line
+# in each copy after the first given a distinct ordinary comment, and, before each code line, comment lines
+# taken at random from the seed's comments (so that commentDensity is the expected fraction of comment lines)
+def generateSource(codeLines, commentLines, numLines, commentDensity, rng, ordinaryCommentMarker = "#"):
+    lines = []
+    copy = 0
+    while len(lines) < numLines:
+        for line in codeLines:
+            while len(commentLines) > 0 and rng.random() < commentDensity:
+                lines.append("%s%s" % (indentation(line), rng.choice(commentLines)))
+            if copy > 0 and len(line.strip()) > 8:
+                line = "%s %s %d" % (line, ordinaryCommentMarker, copy)
+            lines.append(line)
+        copy += 1
+    return lines[:numLines]
+
+# A position to edit, either anywhere, or (for "clustered" edits) near one of a few cluster centres
+def editPosition(numLines, editPattern, clusterCentres, rng):
+    if editPattern == "clustered":
+        position = int(rng.choice(clusterCentres) + rng.gauss(0, 50))
+        return min(max(position, 0), numLines - 1)
+    return rng.randrange(numLines)
+
+# An edited copy of lines (with editRate giving the number of edits as a fraction of the number of lines,
+# and moveFraction the fraction of those edits which are moves of blocks of 3 to 20 lines)
+def editLines(lines, editRate, moveFraction, editPattern, rng):
+    lines = list(lines)
+    numEdits = int(len(lines) * editRate)
+    clusterCentres = [rng.randrange(len(lines)) for cluster in range(max(1, numEdits // 100))]
+    for edit in range(numEdits):
+        if len(lines) < 25:
+            break
+        i = editPosition(len(lines), editPattern, clusterCentres, rng)
+        kind = rng.random()
+        if kind < moveFraction:
+            size = rng.randint(3, 20)
+            block = lines[i:i + size]
+            del lines[i:i + size]
+            j = editPosition(len(lines), editPattern, clusterCentres, rng)
+            lines[j:j] = block
+        elif kind < moveFraction + (1 - moveFraction) / 3:
+            lines.insert(i, "%sinserted_line_%d = %d" % (indentation(lines[i]), edit, rng.randrange(1000)))
+        elif kind < moveFraction + 2 * (1 - moveFraction) / 3:
+            del lines[i]
+        else:
+            lines[i] = "%s changed_%d" % (lines[i], edit)
+    return lines
+
+def writeLines(fileName, lines):
+    with open(fileName, "w") as outputFile:
+        outputFile.write("\n".join(lines))
+        outputFile.write("\n")
+
+# The result of one stage on one generated source
+class BenchmarkResult:
+
+    def __init__(self, seedFileName, numLines, numBytes, stage, seconds, peakMemory):
+        self.seedFileName = seedFileName
+        self.numLines = numLines
+        self.numBytes = numBytes
+        self.stage = stage
+        self.seconds = seconds
+        self.peakMemory = peakMemory
+
+    def key(self):
+        return (self.seedFileName, self.numLines, self.stage)
+
+    def linesPerSecond(self):
+        return self.numLines / self.seconds if self.seconds > 0 else 0.0
+
+    def megabytesPerSecond(self):
+        return self.numBytes / 1000000.0 / self.seconds if self.seconds > 0 else 0.0
+
+    def toJson(self):
+        return {"seed": self.seedFileName, "lines": self.numLines, "bytes": self.numBytes, "stage": self.stage,
+                "seconds": self.seconds, "linesPerSecond": self.linesPerSecond(),
+                "megabytesPerSecond": self.megabytesPerSecond(), "peakMemory": self.peakMemory}
+
+    @staticmethod
+    def fromJson(resultJson):
+        return BenchmarkResult(resultJson["seed"], resultJson["lines"], resultJson["bytes"], resultJson["stage"],
+                               resultJson["seconds"], resultJson["peakMemory"])
+
+    def __str__(self):
+        return " %-28s %-40s %8d lines %9.3fs %10.0f lines/s %7.2f MB/s %9.1f MB peak" % (
+            self.stage, self.seedFileName, self.numLines, self.seconds, self.linesPerSecond(),
+            self.megabytesPerSecond(), self.peakMemory / 1000000.0)
+
+# The best time of repeated runs of runStage (which is given the number of the run, and does any setup
+# it needs before calling startTimer), and the peak memory allocated in one more run
+# (the tools' progress messages are discarded)
+def timeStage(runStage, repeat, measureMemory):
+    bestSeconds = None
+    with open(os.devnull, "w") as devNull, redirect_stdout(devNull):
+        for run in range(repeat):
+            timer = {}
+            runStage(run, lambda: timer.setdefault("start", time.perf_counter()))
+            seconds = time.perf_counter() - timer["start"]
+            bestSeconds = seconds if bestSeconds is None else min(bestSeconds, seconds)
+        peakMemory = 0
+        if measureMemory:
+            tracemalloc.start()
+            try:
+                runStage(repeat, tracemalloc.reset_peak)
+                peakMemory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return bestSeconds, peakMemory
+
+# Generate the sources for one seed and size in workDir, and benchmark each stage on them
+# (with their own random generator, so the sources for a seed and size are the same whichever other seeds and sizes are run)
+def benchmarkSource(seedFileName, numLines, args, workDir):
+    rng = random.Random("%d:%s:%d" % (args.random_seed, seedFileName, numLines))
+    codeLines, commentLines = readSeed(seedFileName)
+    commentClassifier = commentClassifierForFile(seedFileName)
+    commentedLines = generateSource(codeLines, commentLines, numLines, args.comment_density, rng, commentClassifier.marker)
+    kinds = commentClassifier.classify("\n".join(commentedLines))
+    mainLines = editLines([line for line, kind in zip(commentedLines, kinds) if kind == CODE],
+                          args.edit_rate, args.move_fraction, args.edit_pattern, rng)
+    extension = os.path.splitext(seedFileName)[1]
+    commentedFileName = os.path.join(workDir, "commented%s" % extension)
+    mainFileName = os.path.join(workDir, "main%s" % extension)
+    writeLines(commentedFileName, commentedLines)
+    writeLines(mainFileName, mainLines)
+    numBytes = os.path.getsize(commentedFileName)
+    diffEngine = getDiffEngine(args.diff)
+
+    def readStage(run, startTimer):
+        startTimer()
+        readExtremelyCommentedLines(commentedFileName, commentClassifier)
+
+    def mergeForwardStage(run, startTimer):
+        commentedSourceLines = readExtremelyCommentedLines(commentedFileName, commentClassifier)
+        mainSourceLines = readExtremelyCommentedLines(mainFileName, commentClassifier)
+        startTimer()
+        commentedSourceLines.mergeForwardTo(mainSourceLines, io.StringIO(), diffEngine)
+
+    def copyFileFilteredStage(run, startTimer):
+        startTimer()
+        copyFileFiltered(commentedFileName, os.path.join(workDir, "filtered%d%s" % (run, extension)), commentClassifier)
+
+    def processStage(run, startTimer):
+        startTimer()
+        process(commentedFileName, assetDir = args.asset_dir,
+                outputFileName = os.path.join(workDir, "highlighted%d.html" % run))
+
+    stageFunctions = {"readExtremelyCommentedLines": readStage, "mergeForwardTo": mergeForwardStage,
+                      "copyFileFiltered": copyFileFilteredStage, "process": processStage}
+    results = []
+    for stage in args.stages:
+        seconds, peakMemory = timeStage(stageFunctions[stage], args.repeat, not args.no_memory)
+        result = BenchmarkResult(seedFileName, numLines, numBytes, stage, seconds, peakMemory)
+        print(result)
+        results.append(result)
+    return results
+
+def writeResults(fileName, results, args):
+    import pygments
+    resultsJson = {"toolVersion": TOOL_VERSION, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "python": platform.python_version(), "pygments": pygments.__version__,
+                   "platform": platform.platform(),
+                   "settings": {"commentDensity": args.comment_density, "editRate": args.edit_rate,
+                                "moveFraction": args.move_fraction, "editPattern": args.edit_pattern,
+                                "diff": args.diff, "repeat": args.repeat, "randomSeed": args.random_seed},
+                   "results": [result.toJson() for result in results]}
+    with ChangedOutputFile(fileName) as resultsFile:
+        json.dump(resultsJson, resultsFile, indent = 1, sort_keys = True)
+    print("wrote %d results to %s" % (len(results), fileName))
+
+def readResults(fileName):
+    with open(fileName, "r") as resultsFile:
+        return [BenchmarkResult.fromJson(resultJson) for resultJson in json.load(resultsFile)["results"]]
+
+# Print the ratio of each result's time and peak memory to those of the same stage on the same source
+# in the earlier results, returning the number of regressions (ratios more than 1 + threshold)
+def compareResults(oldResults, results, threshold):
+    oldResultsByKey = dict((oldResult.key(), oldResult) for oldResult in oldResults)
+    numRegressions = 0
+    print("compared with earlier results:")
+    for result in results:
+        oldResult = oldResultsByKey.get(result.key())
+        if oldResult is None:
+            continue
+        timeRatio = result.seconds / oldResult.seconds if oldResult.seconds > 0 else 1.0
+        #E (a peak memory of 0 means it wasn't measured)
+        memoryRatio = result.peakMemory / oldResult.peakMemory if result.peakMemory > 0 and oldResult.peakMemory > 0 else 1.0
+        isRegression = timeRatio > 1 + threshold or memoryRatio > 1 + threshold
+        if isRegression:
+            numRegressions += 1
+        print(" %-28s %-40s %8d lines %9.3fs -> %9.3fs (x%.2f), peak memory x%.2f%s" % (
+            result.stage, result.seedFileName, result.numLines, oldResult.seconds, result.seconds,
+            timeRatio, memoryRatio, "  REGRESSION" if isRegression else ""))
+    return numRegressions
+
+def commaSeparatedInts(value):
+    return [int(item) for item in value.split(",")]
+
+def commaSeparatedStages(value):
+    stages = value.split(",")
+    for stage in stages:
+        if stage not in STAGES:
+            raise argparse.ArgumentTypeError("unknown stage %r (expected one of %s)" % (stage, ", ".join(STAGES)))
+    return stages
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Benchmark the merge and highlighting stages on generated sources")
+    argParser.add_argument("--seeds", nargs = "+", default = DEFAULT_SEED_FILES,
+                           help = "source files to generate the benchmark sources from (default: %(default)s)")
+    argParser.add_argument("--sizes", type = commaSeparatedInts, default = DEFAULT_SIZES,
+                           help = "comma-separated numbers of lines of the generated sources (default: 1000,10000,100000,1000000)")
+    argParser.add_argument("--stages", type = commaSeparatedStages, default = STAGES,
+                           help = "comma-separated stages to benchmark (default: %s)" % ",".join(STAGES))
+    argParser.add_argument("--comment-density", type = float, default = 0.2,
+                           help = "expected fraction of generated lines which are extreme or negative comments (default: %(default)s)")
+    argParser.add_argument("--edit-rate", type = float, default = 0.01,
+                           help = "number of edits in the new main source, as a fraction of its lines (default: %(default)s)")
+    argParser.add_argument("--move-fraction", type = float, default = 0.1,
+                           help = "fraction of the edits which move a block of lines (default: %(default)s)")
+    argParser.add_argument("--edit-pattern", choices = EDIT_PATTERNS, default = "scattered",
+                           help = "whether the edits are spread through the file, or clustered in a few places (default: %(default)s)")
+    argParser.add_argument("--diff", choices = sorted(diffEngines), default = DEFAULT_DIFF_ENGINE_NAME,
+                           help = "diff engine for the forward merge (default: %(default)s)")
+    argParser.add_argument("--repeat", type = int, default = 3, help = "number of timed runs of each stage (default: %(default)s)")
+    argParser.add_argument("--no-memory", action = "store_true", help = "don't measure peak memory (which takes an extra run)")
+    argParser.add_argument("--random-seed", type = int, default = 1729, help = "seed for generating the sources (default: %(default)s)")
+    argParser.add_argument("--asset-dir", default = ".",
+                           help = "directory containing the CSS and Javascript files (default: %(default)s)")
+    argParser.add_argument("--output", default = DEFAULT_RESULTS_FILE_NAME, help = "JSON results file (default: %(default)s)")
+    argParser.add_argument("--compare", default = None, metavar = "FILE",
+                           help = "compare the results with an earlier results file, exiting with status 1 if any have regressed")
+    argParser.add_argument("--threshold", type = float, default = 0.2,
+                           help = "fractional increase in time or memory counted as a regression (default: %(default)s)")
+    addTimingArguments(argParser)
+    args = argParser.parse_args()
+    startTiming(args)
+    oldResults = None if args.compare is None else readResults(args.compare)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix = "extreme-doc-benchmark-") as workDir:
+        for seedFileName in args.seeds:
+            for numLines in args.sizes:
+                print("benchmarking %d lines generated from %s ..." % (numLines, seedFileName))
+                results.extend(benchmarkSource(seedFileName, numLines, args, workDir))
+    writeResults(args.output, results, args)
+    if oldResults is not None and compareResults(oldResults, results, args.threshold) > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os, json, shutil, hashlib, filecmp
+
+# A persistent build manifest, recording for each output file the content hashes of the input files it was
+# built from, a fingerprint of the tool and options used, and the hash of the output itself, so that
+# a tool can skip rebuilding an output when none of those have changed.
+
+# Change this whenever a change to any tool changes the output it generates (so that all cached outputs are rebuilt)
+TOOL_VERSION = 5
+
+DEFAULT_MANIFEST_FILE_NAME = ".extreme-doc-cache.json"
+
+def fileHash(fileName, blockSize = 1 << 16):
+    hasher = hashlib.sha1()
+    with open(fileName, "rb") as inputFile:
+        block = inputFile.read(blockSize)
+        while block:
+            hasher.update(block)
+            block = inputFile.read(blockSize)
+    return hasher.hexdigest()
+
+def fileHashOrNone(fileName):
+    return fileHash(fileName) if os.path.exists(fileName) else None
+
+# A fingerprint of a tool and the options it was run with (which must be JSON-serialisable)
+def makeFingerprint(toolName, *options):
+    return json.dumps([toolName, TOOL_VERSION] + list(options))
+
+def cacheKey(fileName):
+    return os.path.normpath(fileName)
+
+# (details is any other JSON-serialisable information about the output, to be kept with it)
+def makeCacheEntry(inputFileNames, fingerprint, outputFileName, details = None):
+    entry = {"inputs": dict((cacheKey(inputFileName), fileHashOrNone(inputFileName)) for inputFileName in inputFileNames),
+             "fingerprint": fingerprint,
+             "output": fileHashOrNone(outputFileName)}
+    if details is not None:
+        entry["details"] = details
+    return entry
+
+def isCacheEntryUpToDate(entry, inputFileNames, fingerprint, outputFileName):
+    if entry is None or entry["fingerprint"] != fingerprint:
+        return False
+    if sorted(entry["inputs"]) != sorted(cacheKey(inputFileName) for inputFileName in inputFileNames):
+        return False
+    for inputFileName in inputFileNames:
+        if fileHashOrNone(inputFileName) != entry["inputs"][cacheKey(inputFileName)]:
+            return False
+    return entry["output"] is not None and fileHashOrNone(outputFileName) == entry["output"]
+
+# (A BuildCache with no manifest file name is held in memory only, e.g. to pass entries to and from worker processes.)
+class BuildCache:
+
+    def __init__(self, manifestFileName = DEFAULT_MANIFEST_FILE_NAME):
+        self.manifestFileName = manifestFileName
+        self.entries = {}
+        if manifestFileName is not None and os.path.exists(manifestFileName):
+            with open(manifestFileName, "r") as manifestFile:
+                self.entries = json.load(manifestFile)
+        self.modified = False
+
+    def getEntry(self, outputFileName):
+        return self.entries.get(cacheKey(outputFileName))
+
+    def setEntry(self, outputFileName, entry):
+        if self.entries.get(cacheKey(outputFileName)) != entry:
+            self.entries[cacheKey(outputFileName)] = entry
+            self.modified = True
+
+    def isUpToDate(self, outputFileName, inputFileNames, fingerprint):
+        return isCacheEntryUpToDate(self.getEntry(outputFileName), inputFileNames, fingerprint, outputFileName)
+
+    # Record that outputFileName has just been built from the current contents of inputFileNames
+    def record(self, outputFileName, inputFileNames, fingerprint, details = None):
+        self.setEntry(outputFileName, makeCacheEntry(inputFileNames, fingerprint, outputFileName, details))
+
+    # The details recorded with the entry for outputFileName (or None)
+    def getDetails(self, outputFileName):
+        entry = self.getEntry(outputFileName)
+        return None if entry is None else entry.get("details")
+
+    def save(self):
+        if self.modified and self.manifestFileName is not None:
+            with ChangedOutputFile(self.manifestFileName) as manifestFile:
+                json.dump(self.entries, manifestFile, indent = 1, sort_keys = True)
+            self.modified = False
+
+# An output file which is written to a temporary file first, and which only replaces the real file
+# if the new contents are different (so that unchanged outputs keep their modification times)
+# A replaced file keeps its permissions (e.g. a script stays executable).
+class ChangedOutputFile:
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.tempFileName = "%s.tmp" % fileName
+        self.changed = False
+
+    def __enter__(self):
+        self.file = open(self.tempFileName, "w")
+        return self.file
+
+    def __exit__(self, excType, excValue, traceback):
+        self.file.close()
+        if excType is not None:
+            os.remove(self.tempFileName)
+        elif os.path.exists(self.fileName) and filecmp.cmp(self.tempFileName, self.fileName, shallow = False):
+            os.remove(self.tempFileName)
+        else:
+            if os.path.exists(self.fileName):
+                shutil.copymode(self.fileName, self.tempFileName)
+            os.replace(self.tempFileName, self.fileName)
+            self.changed = True
+        return False
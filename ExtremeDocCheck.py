@@ -0,0 +1,102 @@
+import os, sys, time
+import argparse
+
+from ExtremeDocTree import findSourcePairs, poolResults, printSummary
+from ExtremeDocComments import CODE, commentClassifierForFile, splitLines
+from ExtremeDocTiming import timings, span, addTimingArguments, startTiming
+
+# Check that every file in the commented tree, with its extreme and negative comments removed (as the backward merge
+# would remove them), is the same as its main source file. Nothing is written, so this can be run as a pre-commit hook.
+
+# The outcome of checking one pair, as sent back from a worker process
+class CheckResult:
+
+    IN_SYNC = "in sync"
+    DRIFTED = "drifted"
+    MISSING = "missing"
+    FAILED = "failed"
+
+    STATUSES = [IN_SYNC, DRIFTED, MISSING, FAILED]
+
+    def __init__(self, relativePath, status, message = ""):
+        self.relativePath = relativePath
+        self.status = status
+        self.message = message
+        self.timingEvents = []
+
+    def __str__(self):
+        return " %-8s %s%s" % (self.status, self.relativePath, ": %s" % self.message if self.message else "")
+
+def readText(fileName):
+    with span("read"), open(fileName, "r") as inputFile:
+        return inputFile.read()
+
+# A description of the first difference between the lines of the main source and the code lines of the commented
+# source (with line numbers in both files, counting from 1)
+def firstDifference(mainText, commentedText, commentClassifier):
+    mainLines = splitLines(mainText)
+    commentedLines, kinds = commentClassifier.classifyLines(commentedText)
+    commentedLineNumbers = [lineNumber for lineNumber, kind in enumerate(kinds, 1) if kind == CODE]
+    codeLines = [commentedLines[lineNumber-1] for lineNumber in commentedLineNumbers]
+    for index, (mainLine, codeLine) in enumerate(zip(mainLines, codeLines)):
+        if mainLine != codeLine:
+            return "main line %d %r != commented line %d %r" % (index + 1, mainLine, commentedLineNumbers[index], codeLine)
+    if len(mainLines) > len(codeLines):
+        return "main line %d %r is not in the commented source" % (len(codeLines) + 1, mainLines[len(codeLines)])
+    if len(codeLines) > len(mainLines):
+        return "commented line %d %r is not in the main source" % (commentedLineNumbers[len(mainLines)],
+                                                                  codeLines[len(mainLines)])
+    return "the files differ only in their final newline"
+
+def comparePair(pair):
+    if not os.path.exists(pair.mainFileName):
+        return CheckResult(pair.relativePath, CheckResult.MISSING, "no main source file %s" % pair.mainFileName)
+    try:
+        mainText = readText(pair.mainFileName)
+        commentedText = readText(pair.commentedFileName)
+        commentClassifier = commentClassifierForFile(pair.commentedFileName)
+        #E comparing the whole stripped text first keeps the common (in sync) case to one comparison per file
+        with span("classify"):
+            if commentClassifier.codeLinesText(commentedText) == mainText:
+                return CheckResult(pair.relativePath, CheckResult.IN_SYNC)
+            return CheckResult(pair.relativePath, CheckResult.DRIFTED, firstDifference(mainText, commentedText, commentClassifier))
+    except Exception as exception:
+        return CheckResult(pair.relativePath, CheckResult.FAILED, "%s: %s" % (type(exception).__name__, exception))
+
+# Check one pair in a worker (returning the timing events recorded by the worker with the result, if timing is on)
+def checkPair(pair):
+    result = comparePair(pair)
+    result.timingEvents = timings.takeEvents()
+    return result
+
+# Check every pair across a process pool, printing each result as it arrives (or only those which aren't in sync,
+# if quiet is True), and return the list of results. Pairs are sent to the workers in batches, since each check is quick.
+def checkTree(pairs, processes = None, quiet = False):
+    batchSize = max(1, len(pairs) // ((processes or os.cpu_count() or 1) * 4))
+    results = []
+    for result in poolResults(checkPair, pairs, processes, batchSize):
+        if not (quiet and result.status == CheckResult.IN_SYNC):
+            print(result)
+        results.append(result)
+    return results
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Check that each file in the commented tree, without its extreme comments, "
+                                        + "is the same as its main source file")
+    argParser.add_argument("--main-root", default = ".", help = "root of main source tree (default: %(default)s)")
+    argParser.add_argument("--commented-root", default = "ed", help = "root of commented tree (default: %(default)s)")
+    argParser.add_argument("--processes", type = int, default = None, help = "number of worker processes (default: one per CPU)")
+    argParser.add_argument("--quiet", action = "store_true", help = "only list the files which aren't in sync")
+    addTimingArguments(argParser)
+    args = argParser.parse_args()
+    startTiming(args)
+
+    startTime = time.time()
+    pairs = findSourcePairs(args.main_root, args.commented_root)
+    results = checkTree(pairs, args.processes, args.quiet)
+    printSummary("checked", results, time.time() - startTime, CheckResult.STATUSES)
+    if any(result.status != CheckResult.IN_SYNC for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import re
+from itertools import compress
+
+from ExtremeDocLexers import LEXER_NAMES_BY_EXTENSION, lexerNameForFile
+
+# Classification of the lines of a source file as code, extreme comments or negative comments,
+# shared by the forward and backward merges. An extreme comment line is a line starting (after any indentation)
+# with the language's line comment marker followed by "E" and a space or tab (e.g. "#E " or "//E "),
+# and a negative comment line is the same with "N". The whole file is scanned with one compiled regex,
+# giving an array with one kind for each line.
+
+CODE = 0
+EXTREME = 1
+NEGATIVE = 2
+
+# Line comment markers for each language (by Pygments lexer name)
+COMMENT_MARKERS_BY_LEXER = {
+    "python": "#",
+    "ruby": "#",
+    "bash": "#",
+    "perl": "#",
+    "javascript": "//",
+    "c": "//",
+    "cpp": "//",
+    "java": "//",
+    "emacs-lisp": ";;",
+    "common-lisp": ";;",
+    "sql": "--",
+    "haskell": "--",
+    "lua": "--",
+}
+
+DEFAULT_COMMENT_MARKER = "#"
+
+# Extensions of the files whose extreme comments can be recognised
+COMMENTED_EXTENSIONS = sorted(extension for extension, lexerName in LEXER_NAMES_BY_EXTENSION.items()
+                              if lexerName in COMMENT_MARKERS_BY_LEXER)
+
+# The lines of text, without their "\n"s (and without an empty line after a final "\n")
+def splitLines(text):
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+class CommentClassifier:
+
+    kindsByLetter = {"E": EXTREME, "N": NEGATIVE}
+
+    # (The regex matches the "\n" before each comment line, which is much faster than matching "^" in multiline mode,
+    # and the text is searched with a "\n" added at the start, so that the first line also has one.)
+    def __init__(self, marker = DEFAULT_COMMENT_MARKER):
+        self.marker = marker
+        self.regex = re.compile(r'\n[ \t]*%s([EN])[ \t]' % re.escape(marker))
+        # (matches the start of a single comment, e.g. a comment token, up to and including the space or tab after the letter)
+        self.prefixRegex = re.compile(r'%s([EN])[ \t]' % re.escape(marker))
+
+    # A bytearray of the kind of each line of text (where the lines are as given by splitLines)
+    def classify(self, text):
+        numLines = text.count("\n") + (0 if text.endswith("\n") or text == "" else 1)
+        kinds = bytearray(numLines)
+        text = "\n%s" % text
+        lineIndex = 0
+        position = 0
+        for match in self.regex.finditer(text):
+            lineIndex += text.count("\n", position, match.start())
+            position = match.start()
+            kinds[lineIndex] = CommentClassifier.kindsByLetter[match.group(1)]
+        return kinds
+
+    # The lines of text, and the kind of each line
+    def classifyLines(self, text):
+        return splitLines(text), self.classify(text)
+
+    # The lines of text which aren't extreme or negative comments, each with its "\n"
+    def codeLinesText(self, text):
+        lines, kinds = self.classifyLines(text)
+        codeLines = list(compress(lines, [kind == CODE for kind in kinds]))
+        if len(codeLines) == 0:
+            return ""
+        #E a final line with no "\n" stays without one, if it is code
+        finalNewline = "\n" if text.endswith("\n") or kinds[-1] != CODE else ""
+        return "%s%s" % ("\n".join(codeLines), finalNewline)
+
+commentClassifiers = {}
+
+def getCommentClassifier(marker = DEFAULT_COMMENT_MARKER):
+    commentClassifier = commentClassifiers.get(marker)
+    if commentClassifier is None:
+        commentClassifier = CommentClassifier(marker)
+        commentClassifiers[marker] = commentClassifier
+    return commentClassifier
+
+# The comment marker for a source file (chosen from its extension or "#!" line, with "#" if the language isn't known)
+def commentMarkerForFile(fileName, code = ""):
+    return COMMENT_MARKERS_BY_LEXER.get(lexerNameForFile(fileName, code), DEFAULT_COMMENT_MARKER)
+
+def commentClassifierForFile(fileName, code = ""):
+    return getCommentClassifier(commentMarkerForFile(fileName, code))
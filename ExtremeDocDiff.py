@@ -0,0 +1,409 @@
+import difflib
+import multiprocessing
+from array import array
+from bisect import bisect_left
+
+# Line diff engines used by the merge tools. Each engine has a getOpcodes(oldLines, newLines) method
+# which returns a list of (tag, i1, i2, j1, j2) tuples, in the same form as difflib.SequenceMatcher.get_opcodes,
+# with tag being one of "equal", "delete", "insert" or "replace".
+
+# Map each distinct line to a small integer, so that the diff algorithms compare ints instead of strings
+def internLines(oldLines, newLines):
+    lineIds = {}
+    oldIds = [lineIds.setdefault(line, len(lineIds)) for line in oldLines]
+    newIds = [lineIds.setdefault(line, len(lineIds)) for line in newLines]
+    return oldIds, newIds
+
+# Convert a sorted list of (i, j, size) matching blocks into opcodes (as per SequenceMatcher.get_opcodes)
+def opcodesFromMatchingBlocks(matchingBlocks, oldLength, newLength):
+    opcodes = []
+    i = j = 0
+    for ai, bj, size in matchingBlocks + [(oldLength, newLength, 0)]:
+        if i < ai and j < bj:
+            opcodes.append(("replace", i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(("delete", i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(("insert", i, ai, j, bj))
+        if size > 0:
+            if len(opcodes) > 0 and opcodes[-1][0] == "equal":
+                tag, i1, i2, j1, j2 = opcodes.pop()
+                opcodes.append(("equal", i1, ai + size, j1, bj + size))
+            else:
+                opcodes.append(("equal", ai, ai + size, bj, bj + size))
+        i, j = ai + size, bj + size
+    return opcodes
+
+# The original engine: difflib.SequenceMatcher applied directly to the lines
+# (quadratic in the worst case, and its "autojunk" heuristic can misalign repeated lines in files over 200 lines)
+class DifflibDiffEngine:
+
+    name = "difflib"
+
+    def getOpcodes(self, oldLines, newLines):
+        return difflib.SequenceMatcher(None, oldLines, newLines).get_opcodes()
+
+# Histogram diff (as in git/jgit): recursively split each region at the longest common run
+# containing the lowest-occurrence line, working on interned line ids.
+class HistogramDiffEngine:
+
+    name = "histogram"
+
+    # lines occurring more often than this (in one region) are never used to choose a split point
+    maxChainLength = 64
+
+    def getOpcodes(self, oldLines, newLines):
+        oldIds, newIds = internLines(oldLines, newLines)
+        matchingBlocks = self.getMatchingBlocks(oldIds, newIds)
+        return opcodesFromMatchingBlocks(matchingBlocks, len(oldIds), len(newIds))
+
+    def getMatchingBlocks(self, a, b):
+        matchingBlocks = []
+        # an explicit stack of regions, so that very large files can't exceed the recursion limit
+        regions = [(0, len(a), 0, len(b))]
+        while len(regions) > 0:
+            alo, ahi, blo, bhi = regions.pop()
+            alo, ahi, blo, bhi = trimCommonEnds(a, alo, ahi, b, blo, bhi, matchingBlocks)
+            if alo < ahi and blo < bhi:
+                self.splitRegion(a, alo, ahi, b, blo, bhi, matchingBlocks, regions)
+        matchingBlocks.sort()
+        return matchingBlocks
+
+    def splitRegion(self, a, alo, ahi, b, blo, bhi, matchingBlocks, regions):
+        match = self.findLowestOccurrenceRegion(a, alo, ahi, b, blo, bhi)
+        if match is None:
+            addFallbackMatchingBlocks(a, alo, ahi, b, blo, bhi, matchingBlocks)
+        else:
+            i, j, size = match
+            matchingBlocks.append(match)
+            regions.append((alo, i, blo, j))
+            regions.append((i + size, ahi, j + size, bhi))
+
+    # Find the longest common run whose rarest line occurs the fewest times in a[alo:ahi]
+    # (returns None if there is no such run with a line occurring no more than maxChainLength times)
+    def findLowestOccurrenceRegion(self, a, alo, ahi, b, blo, bhi):
+        occurrences = {}
+        for i in range(alo, ahi):
+            occurrences.setdefault(a[i], []).append(i)
+        bestCount = self.maxChainLength + 1
+        best = None
+        j = blo
+        while j < bhi:
+            nextJ = j + 1
+            positions = occurrences.get(b[j])
+            if positions is not None and len(positions) <= min(bestCount, self.maxChainLength):
+                for i in positions:
+                    size = 1
+                    count = len(positions)
+                    while i + size < ahi and j + size < bhi and a[i + size] == b[j + size]:
+                        count = min(count, len(occurrences[a[i + size]]))
+                        size += 1
+                    if count < bestCount or (count == bestCount and size > best[2]):
+                        best = (i, j, size)
+                        bestCount = count
+                    nextJ = max(nextJ, j + size)
+            j = nextJ
+        return best
+
+# Patience diff: match up lines which occur exactly once in each region (taking the longest increasing
+# sequence of them), recurse into the gaps between those anchors, and use histogram diff for any gap
+# which has no unique common lines.
+class PatienceDiffEngine(HistogramDiffEngine):
+
+    name = "patience"
+
+    def splitRegion(self, a, alo, ahi, b, blo, bhi, matchingBlocks, regions):
+        anchors = findUniqueCommonAnchors(a, alo, ahi, b, blo, bhi)
+        if len(anchors) == 0:
+            HistogramDiffEngine.splitRegion(self, a, alo, ahi, b, blo, bhi, matchingBlocks, regions)
+        else:
+            i, j = alo, blo
+            for ai, bj in anchors:
+                matchingBlocks.append((ai, bj, 1))
+                regions.append((i, ai, j, bj))
+                i, j = ai + 1, bj + 1
+            regions.append((i, ahi, j, bhi))
+
+# Segmented diff, for very large files: split both versions at anchors (lines occurring exactly once in each,
+# as in patience diff), and diff the segments between the anchors separately, in batches, across a process pool,
+# with the segment engine (histogram diff by default). The matching blocks from all the segments, and the anchors,
+# are then stitched back together into one list of opcodes. Smaller files are just diffed with the segment engine.
+class SegmentedDiffEngine:
+
+    name = "segmented"
+
+    # files with fewer lines than this (old and new together) aren't segmented
+    minSegmentedLines = 20000
+    # segments are sent to the workers in batches of at least this many lines
+    minBatchLines = 5000
+
+    def __init__(self, segmentEngineName = "histogram", processes = None):
+        self.segmentEngineName = segmentEngineName
+        self.processes = processes
+
+    def getOpcodes(self, oldLines, newLines):
+        if len(oldLines) + len(newLines) < self.minSegmentedLines:
+            return getDiffEngine(self.segmentEngineName).getOpcodes(oldLines, newLines)
+        oldIds, newIds = internLines(oldLines, newLines)
+        matchingBlocks = []
+        alo, ahi, blo, bhi = trimCommonEnds(oldIds, 0, len(oldIds), newIds, 0, len(newIds), matchingBlocks)
+        segments = []
+        i, j = alo, blo
+        for ai, bj in findUniqueCommonAnchors(oldIds, alo, ahi, newIds, blo, bhi) + [(ahi, bhi)]:
+            # (a segment which is empty on either side can only be a delete or an insert)
+            if i < ai and j < bj:
+                segments.append((i, ai, j, bj))
+            if ai < ahi:
+                matchingBlocks.append((ai, bj, 1))
+            i, j = ai + 1, bj + 1
+        for segmentBlocks in self.mapBatches(self.segmentBatches(oldIds, newIds, segments)):
+            matchingBlocks.extend(segmentBlocks)
+        matchingBlocks.sort()
+        return opcodesFromMatchingBlocks(matchingBlocks, len(oldIds), len(newIds))
+
+    # Tasks for diffSegmentBatch, each with the segment engine name, and a batch of segments, as
+    # (alo, blo, oldIds[alo:ahi], newIds[blo:bhi]) (so that the workers are only sent the lines they diff)
+    def segmentBatches(self, oldIds, newIds, segments):
+        batch = []
+        batchLines = 0
+        for alo, ahi, blo, bhi in segments:
+            batch.append((alo, blo, oldIds[alo:ahi], newIds[blo:bhi]))
+            batchLines += (ahi - alo) + (bhi - blo)
+            if batchLines >= self.minBatchLines:
+                yield (self.segmentEngineName, batch)
+                batch = []
+                batchLines = 0
+        if len(batch) > 0:
+            yield (self.segmentEngineName, batch)
+
+    # (a pool can't be started from a pool worker, e.g. when merging a tree, so then the batches are diffed in turn)
+    def mapBatches(self, tasks):
+        if self.processes == 1 or multiprocessing.current_process().daemon:
+            for task in tasks:
+                yield diffSegmentBatch(task)
+        else:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                for segmentBlocks in pool.imap_unordered(diffSegmentBatch, tasks):
+                    yield segmentBlocks
+            finally:
+                pool.close()
+                pool.join()
+
+# Diff a batch of segments in a worker, returning the matching blocks of all of them (as positions in the whole files)
+def diffSegmentBatch(task):
+    segmentEngineName, batch = task
+    diffEngine = getDiffEngine(segmentEngineName)
+    matchingBlocks = []
+    for alo, blo, a, b in batch:
+        for tag, i1, i2, j1, j2 in diffEngine.getOpcodes(a, b):
+            if tag == "equal":
+                matchingBlocks.append((alo + i1, blo + j1, i2 - i1))
+    return matchingBlocks
+
+# Move any common prefix and suffix of a region into matchingBlocks, and return the remaining middle region
+def trimCommonEnds(a, alo, ahi, b, blo, bhi, matchingBlocks):
+    prefixSize = 0
+    while alo + prefixSize < ahi and blo + prefixSize < bhi and a[alo + prefixSize] == b[blo + prefixSize]:
+        prefixSize += 1
+    if prefixSize > 0:
+        matchingBlocks.append((alo, blo, prefixSize))
+        alo += prefixSize
+        blo += prefixSize
+    suffixSize = 0
+    while alo < ahi - suffixSize and blo < bhi - suffixSize and a[ahi - suffixSize - 1] == b[bhi - suffixSize - 1]:
+        suffixSize += 1
+    if suffixSize > 0:
+        matchingBlocks.append((ahi - suffixSize, bhi - suffixSize, suffixSize))
+        ahi -= suffixSize
+        bhi -= suffixSize
+    return alo, ahi, blo, bhi
+
+# Used when no suitable split point exists (e.g. in a region made of a few frequently repeated lines):
+# only the line ids which occur in both regions can possibly match, so if there are none, the region is just
+# a replace, and otherwise it is diffed with Myers' linear space O(ND) algorithm, splitting each region
+# at its middle snake (with an explicit stack of regions, as in HistogramDiffEngine.getMatchingBlocks).
+def addFallbackMatchingBlocks(a, alo, ahi, b, blo, bhi, matchingBlocks):
+    if len(set(a[alo:ahi]).intersection(b[blo:bhi])) == 0:
+        return
+    regions = [(alo, ahi, blo, bhi)]
+    while len(regions) > 0:
+        alo, ahi, blo, bhi = regions.pop()
+        alo, ahi, blo, bhi = trimCommonEnds(a, alo, ahi, b, blo, bhi, matchingBlocks)
+        #E after trimming, a region with lines on both sides needs at least 2 edits, so both halves are smaller
+        if alo < ahi and blo < bhi:
+            i1, j1, i2, j2 = findMiddleSnake(a, alo, ahi, b, blo, bhi)
+            if i2 > i1:
+                matchingBlocks.append((i1, j1, i2 - i1))
+            regions.append((alo, i1, blo, j1))
+            regions.append((i2, ahi, j2, bhi))
+
+# The middle snake of the shortest edit script from a[alo:ahi] to b[blo:bhi], as (i1, j1, i2, j2),
+# where a[i1:i2] == b[j1:j2] (found by searching forwards from the start and backwards from the end
+# until the furthest reaching paths on some diagonal overlap)
+def findMiddleSnake(a, alo, ahi, b, blo, bhi):
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    deltaIsOdd = delta % 2 == 1
+    maxD = (n + m + 1) // 2
+    offset = maxD + 1
+    # the furthest x (counted from alo forwards, or from ahi backwards) reached on each diagonal k = x - y
+    forwardX = [0] * (2 * offset + 1)
+    backwardX = [0] * (2 * offset + 1)
+    for d in range(maxD + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forwardX[offset + k - 1] < forwardX[offset + k + 1]):
+                x = forwardX[offset + k + 1]
+            else:
+                x = forwardX[offset + k - 1] + 1
+            y = x - k
+            startX, startY = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forwardX[offset + k] = x
+            backwardK = delta - k
+            if deltaIsOdd and -(d - 1) <= backwardK <= d - 1 and x + backwardX[offset + backwardK] >= n:
+                return alo + startX, blo + startY, alo + x, blo + y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backwardX[offset + k - 1] < backwardX[offset + k + 1]):
+                x = backwardX[offset + k + 1]
+            else:
+                x = backwardX[offset + k - 1] + 1
+            y = x - k
+            startX, startY = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backwardX[offset + k] = x
+            forwardK = delta - k
+            if not deltaIsOdd and -d <= forwardK <= d and x + forwardX[offset + forwardK] >= n:
+                return ahi - x, bhi - y, ahi - startX, bhi - startY
+    raise Exception("No middle snake found for regions of %d and %d lines" % (n, m))
+
+# Find pairs (i, j) where a[i] == b[j] and the line occurs exactly once in each of a[alo:ahi] and b[blo:bhi],
+# and return the longest subsequence of those pairs which is increasing in both i and j.
+def findUniqueCommonAnchors(a, alo, ahi, b, blo, bhi):
+    oldCounts = {}
+    for i in range(alo, ahi):
+        line = a[i]
+        oldCounts[line] = oldCounts.get(line, 0) + 1
+    newPositions = {}
+    for j in range(blo, bhi):
+        line = b[j]
+        if oldCounts.get(line) == 1:
+            newPositions[line] = -1 if line in newPositions else j
+    pairs = [(i, newPositions[a[i]]) for i in range(alo, ahi) if newPositions.get(a[i], -1) >= 0]
+    return longestIncreasingPairs(pairs)
+
+# Patience sorting: given pairs sorted by i, return the longest subsequence with increasing j
+def longestIncreasingPairs(pairs):
+    pileTops = []
+    pileTopIndexes = []
+    predecessors = []
+    for index, (i, j) in enumerate(pairs):
+        pile = bisect_left(pileTops, j)
+        predecessors.append(pileTopIndexes[pile-1] if pile > 0 else -1)
+        if pile == len(pileTops):
+            pileTops.append(j)
+            pileTopIndexes.append(index)
+        else:
+            pileTops[pile] = j
+            pileTopIndexes[pile] = index
+    result = []
+    index = pileTopIndexes[-1] if len(pileTopIndexes) > 0 else -1
+    while index >= 0:
+        result.append(pairs[index])
+        index = predecessors[index]
+    result.reverse()
+    return result
+
+# Find blocks of lines which the opcodes show as deleted (or replaced) from oldLines, and inserted (or replaced)
+# into newLines, i.e. blocks which have been moved. Each block is anchored on a line occurring exactly once
+# among the deleted lines and exactly once among the inserted lines, and extended in both directions while
+# the deleted and inserted lines still match. Returns a list of (i, j, size) blocks, with size >= minBlockSize.
+def findMovedBlocks(oldLines, newLines, opcodes, minBlockSize = 2):
+    isDeleted = bytearray(len(oldLines))
+    isInserted = bytearray(len(newLines))
+    deletedCounts = {}
+    insertedPositions = {}
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != "equal":
+            for i in range(i1, i2):
+                isDeleted[i] = 1
+                deletedCounts[oldLines[i]] = deletedCounts.get(oldLines[i], 0) + 1
+            for j in range(j1, j2):
+                isInserted[j] = 1
+                line = newLines[j]
+                insertedPositions[line] = -1 if line in insertedPositions else j
+    movedBlocks = []
+    for i in range(len(oldLines)):
+        if isDeleted[i] and deletedCounts[oldLines[i]] == 1 and insertedPositions.get(oldLines[i], -1) >= 0:
+            j = insertedPositions[oldLines[i]]
+            if not isInserted[j]:
+                continue # (already part of another moved block)
+            start = 0
+            while (i + start > 0 and j + start > 0 and isDeleted[i + start - 1] and isInserted[j + start - 1] 
+                   and oldLines[i + start - 1] == newLines[j + start - 1]):
+                start -= 1
+            end = 1
+            while (i + end < len(oldLines) and j + end < len(newLines) and isDeleted[i + end] and isInserted[j + end] 
+                   and oldLines[i + end] == newLines[j + end]):
+                end += 1
+            if end - start >= minBlockSize:
+                movedBlocks.append((i + start, j + start, end - start))
+                for k in range(start, end):
+                    isDeleted[i + k] = 0
+                    isInserted[j + k] = 0
+    return movedBlocks
+
+# The chunks of a three-way merge (as in diff3) of two versions, a and b, of baseLines, as a list of
+# (isStable, baseStart, baseEnd, aStart, aEnd, bStart, bEnd). A stable chunk is lines which are the same in all three,
+# and the unstable chunks in between are the lines changed in a, in b, or in both.
+def threeWayChunks(baseLines, aLines, bLines, diffEngine):
+    aIndexes = matchedIndexes(len(baseLines), diffEngine.getOpcodes(baseLines, aLines))
+    bIndexes = matchedIndexes(len(baseLines), diffEngine.getOpcodes(baseLines, bLines))
+    chunks = []
+    base = a = b = 0
+    while base < len(baseLines) or a < len(aLines) or b < len(bLines):
+        start = base
+        while base < len(baseLines) and aIndexes[base] == a and bIndexes[base] == b:
+            base += 1
+            a += 1
+            b += 1
+        if base > start:
+            chunks.append((True, start, base, a - (base - start), a, b - (base - start), b))
+        #E (the unstable chunk ends at the next base line matched in both versions, which follows a and b,
+        #E since the matches are increasing)
+        baseEnd = base
+        while baseEnd < len(baseLines) and (aIndexes[baseEnd] < 0 or bIndexes[baseEnd] < 0):
+            baseEnd += 1
+        if baseEnd < len(baseLines):
+            aEnd, bEnd = aIndexes[baseEnd], bIndexes[baseEnd]
+        else:
+            aEnd, bEnd = len(aLines), len(bLines)
+        if baseEnd > base or aEnd > a or bEnd > b:
+            chunks.append((False, base, baseEnd, a, aEnd, b, bEnd))
+        base, a, b = baseEnd, aEnd, bEnd
+    return chunks
+
+# The index in the new lines matched by each old line in the opcodes (or -1 if it isn't matched)
+def matchedIndexes(oldLength, opcodes):
+    indexes = array("l", [-1]) * oldLength
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            for i in range(i1, i2):
+                indexes[i] = j1 + (i - i1)
+    return indexes
+
+diffEngines = dict((engine.name, engine) for engine in
+                   [DifflibDiffEngine(), HistogramDiffEngine(), PatienceDiffEngine(), SegmentedDiffEngine()])
+
+# (segmented diff is the same as histogram diff for files of fewer than SegmentedDiffEngine.minSegmentedLines lines)
+DEFAULT_DIFF_ENGINE_NAME = "segmented"
+
+def getDiffEngine(name = DEFAULT_DIFF_ENGINE_NAME):
+    if name not in diffEngines:
+        raise Exception("Unknown diff engine %r (expected one of %s)" % (name, ", ".join(sorted(diffEngines))))
+    return diffEngines[name]
@@ -0,0 +1,273 @@
+import os, hashlib
+
+from pygments.filter import Filter
+from pygments.token import Token, STANDARD_TYPES
+from pygments.formatters import HtmlFormatter
+
+from ExtremeDocCache import ChangedOutputFile
+from ExtremeDocTiming import accumulatedSpan
+from ExtremeDocComments import getCommentClassifier
+
+# The Pygments-based parts of highlighting, kept separate from ExtremeDocHighlighting so that
+# Pygments is only imported when a file actually has to be highlighted.
+
+STANDARD_TYPES[Token.Comment.Negative] = "cn"
+STANDARD_TYPES[Token.Comment.Extreme] = "ce"
+
+#E A pygments filter which will relabel comments starting with "#N "/"#E " as being of type Token.Comment.Negative/Extreme
+#E (or with the language's own line comment marker in place of "#", given as the commentMarker option,
+#E and with a tab or a space after the letter, the same as the comment classifier used by the merges)
+class RelabelExtremeCommentsFilter(Filter):
+    
+    tokenTypesByLetter = {"N": Token.Comment.Negative, "E": Token.Comment.Extreme}
+    
+    def __init__(self, **options):
+        Filter.__init__(self, **options)
+        self.prefixRegex = getCommentClassifier(options.get("commentMarker", "#")).prefixRegex
+        
+    def filter (self, lexer, stream):
+        for ttype, value in stream:
+            if ttype == Token.Comment.Single:
+                match = self.prefixRegex.match(value)
+                if match is not None:
+                    yield RelabelExtremeCommentsFilter.tokenTypesByLetter[match.group(1)], value[match.end():]
+                else:
+                    yield ttype, value
+            else:
+                #print(" ttype = %s, value = %r" % (ttype, value))
+                yield ttype, value
+                
+# A sub-class of HtmlFormatter, which adds its own header/footer, and which post-processes the highlighted code
+# (HtmlFormatter has a header, but it doesn't have enough options for what we want)
+# CSS and Javascript files are read from assetDir, and are either included in the page (if selfContained is true),
+# or linked to with a fingerprint of their contents in the URL (so that browsers don't use out-of-date copies).
+class HtmlPageFormatter(HtmlFormatter):
+    
+    def __init__(self, **options):
+        HtmlFormatter.__init__(self, **options)
+        self.relativeBaseDir = options.get("relativeBaseDir", "")
+        self.cssFileNames = options.get("cssFiles", [])
+        self.javascriptFileNames = options.get("javascriptFiles", [])
+        self.selfContained = options.get("selfContained", False)
+        self.assetDir = options.get("assetDir", "")
+        self.linesPerChunk = options.get("linesPerChunk", 0)
+        self.chunkBaseName = options.get("chunkBaseName", "")
+        self.chunks = []
+        self.numNegativeComments = 0
+        self.numExtremeComments = 0
+    
+    def htmlStart(self, title = None):
+        return """%s
+<html>
+<head>
+<title>%s</title>
+%s
+%s
+</head>
+<body>
+""" % (self.htmlDocType(), title or self.title, self.cssIncludes(), self.javascriptIncludes())
+    
+    def readAsset(self, assetFile):
+        with open(os.path.join(self.assetDir, assetFile), "r") as inputFile:
+            return inputFile.read()
+    
+    #E The URL of an asset file, with a "?v=" fingerprint of its contents (if it exists)
+    def assetUrl(self, assetFile):
+        assetFileName = os.path.join(self.assetDir, assetFile)
+        if not os.path.exists(assetFileName):
+            return "%s%s" % (self.relativeBaseDir, assetFile)
+        with open(assetFileName, "rb") as inputFile:
+            fingerprint = hashlib.sha1(inputFile.read()).hexdigest()[:12]
+        return "%s%s?v=%s" % (self.relativeBaseDir, assetFile, fingerprint)
+    
+    def cssIncludes(self):
+        if self.selfContained:
+            return "\n".join(["<style type = \"text/css\">\n%s</style>" % self.readAsset(cssFile)
+                              for cssFile in self.cssFiles()])
+        return "\n".join(["<link href = \"%s\" type = \"text/css\" rel = \"stylesheet\"/>" % self.assetUrl(cssFile)
+                          for cssFile in self.cssFiles()])
+    
+    def javascriptIncludes(self):
+        if self.selfContained:
+            #E "</" is escaped so that the script can't end the <script> element early
+            return "\n".join(["<script type=\"text/javascript\">\n%s</script>" % self.readAsset(javascriptFile).replace("</", "<\\/")
+                              for javascriptFile in self.javascriptFiles()])
+        return "\n".join(["<script src=\"%s\" type=\"text/javascript\"></script>" % self.assetUrl(javascriptFile)
+                          for javascriptFile in self.javascriptFiles()])
+    
+    def cssFiles(self):
+        return self.cssFileNames
+    
+    def javascriptFiles(self):
+        return self.javascriptFileNames
+
+    #E The HTML document type declaration    
+    def htmlDocType(self):
+        return "<!DOCTYPE html>"
+    
+    #E HTML that goes at the end of the page
+    def htmlEnd(self):
+        return "</body></html>\n"
+
+    codeLineTemplate = "<div class=\"%s\"><code>%s%s</code></div>"
+    anchoredCodeLineTemplate = "<div class=\"%s\" id=\"L%d\"><code>%s%s</code></div>"
+    
+    def taggedCodeLine(self, indentWhitespace, line, tag, lineNumber = None):
+        if lineNumber is not None:
+            return HtmlPageFormatter.anchoredCodeLineTemplate % (tag, lineNumber, 
+                                                                 indentWhitespace.replace(" ", "&nbsp"), line)
+        return HtmlPageFormatter.codeLineTemplate % (tag, 
+                                                     indentWhitespace.replace(" ", "&nbsp"), 
+                                                     line)
+    
+    #E A line whose first (non-whitespace) token is a negative or extreme comment is tagged with a class
+    #E that lets the page show or hide it
+    lineTags = {Token.Comment.Negative: "cn-line", Token.Comment.Extreme: "ce-line"}
+    
+    htmlEscapeTable = {ord("&"): "&amp;", ord("<"): "&lt;", ord(">"): "&gt;", ord('"'): "&quot;", ord("'"): "&#39;"}
+    
+    def spanHtml(self, cssClass, text):
+        escapedText = text.translate(HtmlPageFormatter.htmlEscapeTable)
+        if cssClass:
+            return "<span class=\"%s\">%s</span>" % (cssClass, escapedText)
+        else:
+            return escapedText
+    
+    # The tag and the <div> for one line of source, given the token type/string pairs on that line 
+    # (none containing "\n"). Leading whitespace becomes the indentation, and consecutive tokens with
+    # the same CSS class share one <span>. If lineNumber is given, the <div> has an "L<lineNumber>" id.
+    def taggedCodeLineHtml(self, lineTokens, lineNumber = None):
+        indentWhitespace = ""
+        tag = None
+        spans = []
+        cssClass, text = None, ""
+        for ttype, value in lineTokens:
+            if tag is None:
+                strippedValue = value.lstrip(" \t")
+                indentWhitespace += value[:len(value) - len(strippedValue)]
+                if strippedValue == "":
+                    continue
+                value = strippedValue
+                tag = HtmlPageFormatter.lineTags.get(ttype, "line")
+            tokenCssClass = self._get_css_class(ttype)
+            if tokenCssClass != cssClass:
+                if text != "":
+                    spans.append(self.spanHtml(cssClass, text))
+                cssClass, text = tokenCssClass, ""
+            text += value
+        if text != "":
+            spans.append(self.spanHtml(cssClass, text))
+        tag = tag or "line"
+        return tag, self.taggedCodeLine(indentWhitespace, "".join(spans), tag, lineNumber)
+    
+    # Count the negative and extreme comment lines written (returns 1 if the line was one of those)
+    def countCommentLine(self, tag):
+        if tag == "cn-line":
+            self.numNegativeComments += 1
+        elif tag == "ce-line":
+            self.numExtremeComments += 1
+        else:
+            return 0
+        return 1
+    
+    # Generate the list of token type/string pairs for each line, holding only the current line's tokens
+    def tokenLines(self, tokensource):
+        lineTokens = []
+        for ttype, value in tokensource:
+            lineValues = value.split("\n")
+            for lineValue in lineValues[:-1]:
+                if lineValue != "":
+                    lineTokens.append((ttype, lineValue))
+                yield lineTokens
+                lineTokens = []
+            if lineValues[-1] != "":
+                lineTokens.append((ttype, lineValues[-1]))
+        if len(lineTokens) > 0:
+            yield lineTokens
+    
+    # Write one <div> per source line directly from the token stream
+    # (or if linesPerChunk is set, write the lines to chunk pages, and an index of them to outfile)
+    def format_unencoded(self, tokensource, outfile):
+        if self.linesPerChunk > 0:
+            self.formatChunked(tokensource, outfile)
+            return
+        outfile.write(self.htmlStart())
+        outfile.write("<div class=\"%s\">\n" % self.cssclass)
+        with accumulatedSpan("divify", self.taggedCodeLineHtml) as taggedCodeLineHtml:
+            for lineTokens in self.tokenLines(tokensource):
+                tag, lineHtml = taggedCodeLineHtml(lineTokens)
+                self.countCommentLine(tag)
+                outfile.write("%s\n" % lineHtml)
+        outfile.write("</div>\n")
+        outfile.write(self.htmlEnd())
+        
+    # Chunk pages are written next to the index page, numbered from 1
+    def chunkFileName(self, chunkNumber):
+        return "%s.%d.html" % (self.chunkBaseName, chunkNumber)
+    
+    def chunkUrl(self, chunkNumber, lineNumber = None):
+        return "%s%s" % (os.path.basename(self.chunkFileName(chunkNumber)), 
+                         "" if lineNumber is None else "#L%d" % lineNumber)
+    
+    def writeChunkNavigation(self, chunkFile, chunkNumber, hasNextChunk):
+        links = ["<a href=\"%s\">index</a>" % os.path.basename("%s.html" % self.chunkBaseName)]
+        if chunkNumber > 1:
+            links.append("<a href=\"%s\">previous</a>" % self.chunkUrl(chunkNumber - 1))
+        if hasNextChunk:
+            links.append("<a href=\"%s\">next</a>" % self.chunkUrl(chunkNumber + 1))
+        chunkFile.write("<div class=\"chunkNavigation\">%s</div>\n" % " ".join(links))
+    
+    def startChunk(self, firstLineNumber):
+        self.chunks.append([firstLineNumber, firstLineNumber, 0, 0])
+        self.chunkLinesHtml = []
+    
+    # Write the page of the last chunk started, with navigation above and below its lines
+    # (which can only be written once it's known whether there is a next chunk)
+    def endChunk(self, hasNextChunk):
+        chunkNumber = len(self.chunks)
+        with ChangedOutputFile(self.chunkFileName(chunkNumber)) as chunkFile:
+            chunkFile.write(self.htmlStart("%s (from line %d)" % (self.title, self.chunks[-1][0])))
+            self.writeChunkNavigation(chunkFile, chunkNumber, hasNextChunk)
+            chunkFile.write("<div class=\"%s\">\n" % self.cssclass)
+            for lineHtml in self.chunkLinesHtml:
+                chunkFile.write("%s\n" % lineHtml)
+            chunkFile.write("</div>\n")
+            self.writeChunkNavigation(chunkFile, chunkNumber, hasNextChunk)
+            chunkFile.write(self.htmlEnd())
+        self.chunkLinesHtml = []
+    
+    # Write the lines into chunk pages of linesPerChunk lines each, with each line's <div> having an "L<line number>" id.
+    # The lines of each chunk are kept until the first line of the next one arrives (or the lines end), when its page
+    # is written, and then an index page of the chunks (with their line ranges and comment counts) is written to outfile.
+    # self.chunks holds [firstLineNumber, lastLineNumber, numNegativeComments, numExtremeComments] for each chunk.
+    def formatChunked(self, tokensource, outfile):
+        self.chunks = []
+        lineNumber = 0
+        with accumulatedSpan("divify", self.taggedCodeLineHtml) as taggedCodeLineHtml:
+            for lineTokens in self.tokenLines(tokensource):
+                lineNumber += 1
+                if (lineNumber - 1) % self.linesPerChunk == 0:
+                    if len(self.chunks) > 0:
+                        self.endChunk(True)
+                    self.startChunk(lineNumber)
+                tag, lineHtml = taggedCodeLineHtml(lineTokens, lineNumber)
+                self.chunkLinesHtml.append(lineHtml)
+                chunk = self.chunks[-1]
+                chunk[1] = lineNumber
+                if self.countCommentLine(tag):
+                    chunk[2 if tag == "cn-line" else 3] += 1
+        if len(self.chunks) > 0:
+            self.endChunk(False)
+        self.writeChunkIndex(outfile)
+        
+    def writeChunkIndex(self, outfile):
+        outfile.write(self.htmlStart())
+        outfile.write("<table class=\"chunkIndex\">\n")
+        outfile.write("<tr><th>Lines</th><th>Negative comments</th><th>Extreme comments</th></tr>\n")
+        for chunkNumber, (firstLineNumber, lastLineNumber, numNegativeComments, numExtremeComments) \
+                in enumerate(self.chunks, 1):
+            outfile.write("<tr><td><a href=\"%s\">%d-%d</a></td><td>%d</td><td>%d</td></tr>\n" % 
+                          (self.chunkUrl(chunkNumber, firstLineNumber), firstLineNumber, lastLineNumber, 
+                           numNegativeComments, numExtremeComments))
+        outfile.write("</table>\n")
+        outfile.write(self.htmlEnd())
@@ -1,17 +1,31 @@
 import re
-import difflib
+import argparse
+from array import array
+import json
+from sys import intern
 
+from ExtremeDocDiff import getDiffEngine, diffEngines, findMovedBlocks, threeWayChunks, DEFAULT_DIFF_ENGINE_NAME
+from ExtremeDocCache import BuildCache, ChangedOutputFile, makeFingerprint
+from ExtremeDocSnapshot import BaseSnapshots
+from ExtremeDocComments import CODE, commentClassifierForFile
+from ExtremeDocTiming import span, addTimingArguments, startTiming
+
+# A view of one code line in an ExtremelyCommentedLines, together with the extreme comments preceding it
 class ExtremelyCommentedLine:
     
-    def __init__(self):
-        self.line = None
-        self.extremeComments = []
-        
-    def setLine(self, line):
-        self.line = line
+    __slots__ = ("owner", "index")
+    
+    def __init__(self, owner, index):
+        self.owner = owner
+        self.index = index
         
-    def addExtremeComment(self, line):
-        self.extremeComments.append(line)
+    @property
+    def line(self):
+        return self.owner.codeLines[self.index]
+    
+    @property
+    def extremeComments(self):
+        return self.owner.getExtremeComments(self.index)
     
     def __str__(self):
         return "%s%s" % ("".join(["%s\n" % comment for comment in self.extremeComments]), 
@@ -20,99 +34,427 @@ class ExtremelyCommentedLine:
     def __repr__(self):
         return "%sLINE: %s\n\n" % ("".join([" COMMENT: %s\n" % comment for comment in self.extremeComments]), 
                              self.line)
+
+# The sequence of ExtremelyCommentedLine views of an ExtremelyCommentedLines (created on demand)
+class ExtremelyCommentedLineViews:
+    
+    __slots__ = ("owner",)
+    
+    def __init__(self, owner):
+        self.owner = owner
         
-class ExtremelyCommentedLines:
+    def __len__(self):
+        return len(self.owner.codeLines)
+    
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.owner.codeLines)
+        if not 0 <= index < len(self.owner.codeLines):
+            raise IndexError("line index out of range")
+        return ExtremelyCommentedLine(self.owner, index)
     
-    def __init__(self, extremeCommentLineSelector):
-        self.lines = []
-        self.extremeCommentLineSelector = extremeCommentLineSelector
+    def __iter__(self):
+        for index in range(len(self.owner.codeLines)):
+            yield ExtremelyCommentedLine(self.owner, index)
+        
+# The (i, j, size) blocks of code lines moved from old line i to new line j, indexed by line in both versions
+class MovedLines:
+    
+    def __init__(self, movedBlocks):
+        self.movedBlocks = movedBlocks
+        self.newIndexes = {}
+        self.oldIndexes = {}
+        for i, j, size in movedBlocks:
+            for k in range(size):
+                self.newIndexes[i + k] = j + k
+                self.oldIndexes[j + k] = i + k
+                
+    def __len__(self):
+        return len(self.movedBlocks)
+    
+    def __iter__(self):
+        return iter(self.movedBlocks)
 
+# Code lines are kept in one list of interned strings (so that repeated lines share one string object,
+# whose hash is only computed once), and all the extreme comments in one flat list, with commentEnds[i]
+# being the end of the comments for code line i (which start where the previous line's comments end).
+# Lines are classified as code or comments by a CommentClassifier (from ExtremeDocComments).
+class ExtremelyCommentedLines:
+    
+    def __init__(self, commentClassifier):
+        self.codeLines = []
+        self.comments = []
+        self.commentEnds = array("l")
+        self.commentClassifier = commentClassifier
         
-    def addLines(self, lines):
-        nextLine = None
-        for line in lines:
-            if line.endswith("\n"):
-                line = line[:-1]
-            if nextLine == None:
-                nextLine = ExtremelyCommentedLine()
-                self.lines.append(nextLine)
-            if self.extremeCommentLineSelector(line):
-                nextLine.addExtremeComment(line)
+    @property
+    def lines(self):
+        return ExtremelyCommentedLineViews(self)
+        
+    # Add the lines of text (classified in one pass over the whole text)
+    def addText(self, text):
+        lines, kinds = self.commentClassifier.classifyLines(text)
+        for line, kind in zip(lines, kinds):
+            if kind == CODE:
+                self.codeLines.append(intern(line))
+                self.commentEnds.append(len(self.comments))
             else:
-                nextLine.setLine(line)
-                nextLine = None
-        if nextLine != None:
-            if nextLine.line == None:
-                nextLine.setLine("")
+                self.comments.append(line)
+        # comments at the end, with no following code line, are attached to an empty line
+        if len(self.comments) > self.commentStart(len(self.codeLines)):
+            self.codeLines.append("")
+            self.commentEnds.append(len(self.comments))
+    
+    # Add one code line, preceded by its comments
+    def addLine(self, codeLine, comments = []):
+        self.comments.extend(comments)
+        self.codeLines.append(codeLine)
+        self.commentEnds.append(len(self.comments))
+    
+    def commentStart(self, index):
+        return self.commentEnds[index-1] if index > 0 else 0
                 
+    def getExtremeComments(self, index):
+        return self.comments[self.commentStart(index):self.commentEnds[index]]
+    
+    # (this is the internal list of code lines, so it should not be modified)
     def getUncommentedLines(self):
-        return [line.line for line in self.lines]
+        return self.codeLines
                 
     def __str__(self):
         return "".join([str(line) for line in self.lines])
     
-    blockHeaderTemplate = "## %s ###########################################################\n"
+    blockHeaderTemplate = "## %s ###########################################################"
     
-    def mergeForwardTo(self, newSourceLines, outFile):
-        oldUncommentedLines = self.getUncommentedLines()
-        newUncommentedLines = newSourceLines.getUncommentedLines()
-        matcher = difflib.SequenceMatcher(None, oldUncommentedLines, newUncommentedLines)
-        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-            if tag == "equal":
-                outFile.write(ExtremelyCommentedLines.blockHeaderTemplate % "EQUAL")
-                for i in range(i1, i2):
-                    oldLine = self.lines[i]
-                    newSourceLine = newSourceLines.lines[i + (j1-i1)]
-                    for comment in oldLine.extremeComments:
-                        outFile.write("%s\n" % "%s" % comment)
-                    if len(newSourceLine.extremeComments) > 0:
-                        outFile.write("%s\n" % "#>>>")
-                        for comment in newSourceLine.extremeComments:
-                            outFile.write("%s\n" % "%s" % comment)
-                    outFile.write("%s\n" % newSourceLine.line)
-            elif tag == "delete":
-                outFile.write(ExtremelyCommentedLines.blockHeaderTemplate % "DELETE")
-                for i in range(i1, i2):
-                    outFile.write("%s\n" % "%s" % self.lines[i])
-            elif tag == "insert":
-                outFile.write(ExtremelyCommentedLines.blockHeaderTemplate % "INSERT")
-                for i in range(j1, j2):
-                    outFile.write("%s\n" % "%s" % newSourceLines.lines[i])
-            elif tag == "replace":
-                outFile.write(ExtremelyCommentedLines.blockHeaderTemplate % "REPLACE")
+    # Add lines i1:i2 of these lines, which match lines j1:j2 of newSourceLines, to the list of output lines,
+    # with the comments from both, and the code line from newSourceLines
+    def addEqualLines(self, newSourceLines, i1, i2, j1, j2, outputLines):
+        for i in range(i1, i2):
+            j = i + (j1-i1)
+            outputLines.extend(self.getExtremeComments(i))
+            newComments = newSourceLines.getExtremeComments(j)
+            if len(newComments) > 0:
+                outputLines.append("#>>>")
+                outputLines.extend(newComments)
+            outputLines.append(newSourceLines.codeLines[j])
+    
+    # Add lines j1:j2 of newSourceLines, where any which have moved from old lines get the old lines' comments
+    def addNewLines(self, newSourceLines, j1, j2, outputLines, movedLines):
+        for j in range(j1, j2):
+            if j in movedLines.oldIndexes:
+                i = movedLines.oldIndexes[j]
+                self.addEqualLines(newSourceLines, i, i + 1, j, j + 1, outputLines)
+            else:
+                outputLines.extend(newSourceLines.getExtremeComments(j))
+                outputLines.append(newSourceLines.codeLines[j])
+    
+    # Add a "delete", "insert" or "replace" block, with its header. Old lines which have moved are added
+    # without their comments, which are instead added before the new lines they have moved to.
+    def addChangedBlock(self, newSourceLines, tag, i1, i2, j1, j2, outputLines, movedLines):
+        outputLines.append(ExtremelyCommentedLines.blockHeaderTemplate % tag.upper())
+        for i in range(i1, i2):
+            if i not in movedLines.newIndexes:
+                outputLines.extend(self.getExtremeComments(i))
+            outputLines.append(self.codeLines[i])
+        if tag == "replace":
+            outputLines.append("#>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
+        self.addNewLines(newSourceLines, j1, j2, outputLines, movedLines)
+                
+    def findMovedLines(self, oldLines, newLines, opcodes, detectMoves):
+        return MovedLines(findMovedBlocks(oldLines, newLines, opcodes) if detectMoves else [])
+    
+    # Three-way merge of the code lines of these lines and of newSourceLines, both changed from baseLines
+    # (the code lines of the main source as at the last sync). Returns the merged lines (with the code lines
+    # from newSourceLines where the main source has changed, and from these lines where only they have changed),
+    # the opcodes from these lines to the merged lines, and the indexes of the opcodes changed on both sides.
+    def threeWayMerge(self, newSourceLines, baseLines, diffEngine):
+        mergedLines = ExtremelyCommentedLines(self.commentClassifier)
+        opcodes = []
+        bothChangedIndexes = set()
+        def addOpcode(tag, i1, i2, j1, j2):
+            if tag == "equal" and len(opcodes) > 0 and opcodes[-1][0] == "equal":
+                tag, i1, previousI2, j1, previousJ2 = opcodes.pop()
+            opcodes.append((tag, i1, i2, j1, j2))
+        def addNewSourceLines(j1, j2):
+            for j in range(j1, j2):
+                mergedLines.addLine(newSourceLines.codeLines[j], newSourceLines.getExtremeComments(j))
+        codeLines = self.codeLines
+        newLines = newSourceLines.codeLines
+        for isStable, base1, base2, i1, i2, j1, j2 in threeWayChunks(baseLines, codeLines, newLines, diffEngine):
+            start = len(mergedLines.codeLines)
+            if isStable or codeLines[i1:i2] == newLines[j1:j2]:
+                addNewSourceLines(j1, j2)
+                addOpcode("equal", i1, i2, start, len(mergedLines.codeLines))
+            elif newLines[j1:j2] == baseLines[base1:base2]:
+                #E only the commented file has changed here, so its code lines are kept (and its comments stay on them)
                 for i in range(i1, i2):
-                    outFile.write("%s\n" % "%s" % self.lines[i])
-                outFile.write("%s\n" % "#>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
-                for i in range(j1, j2):
-                    outFile.write("%s\n" % "%s" % newSourceLines.lines[i])
+                    mergedLines.addLine(codeLines[i])
+                addOpcode("equal", i1, i2, start, len(mergedLines.codeLines))
+            else:
+                addNewSourceLines(j1, j2)
+                tag = "replace" if i2 > i1 and j2 > j1 else "delete" if i2 > i1 else "insert"
+                if codeLines[i1:i2] != baseLines[base1:base2]:
+                    bothChangedIndexes.add(len(opcodes))
+                addOpcode(tag, i1, i2, start, len(mergedLines.codeLines))
+        return mergedLines, opcodes, bothChangedIndexes
+    
+    # The result of merging newSourceLines forward into these lines. If baseLines (the code lines of the main source
+    # as at the last sync) is given, the merge is three-way (see threeWayMerge), so that only the changes made to
+    # the main source since then are changed blocks, and blocks changed in both are conflicts.
+    # If detectMoves is True, comments on blocks of code lines which have moved are re-attached at their new location.
+    def mergeResult(self, newSourceLines, diffEngine = None, detectMoves = True, baseLines = None):
+        if diffEngine is None:
+            diffEngine = getDiffEngine()
+        oldLines = self.getUncommentedLines()
+        bothChangedIndexes = set()
+        with span("diff"):
+            if baseLines is None:
+                opcodes = diffEngine.getOpcodes(oldLines, newSourceLines.getUncommentedLines())
+            else:
+                newSourceLines, opcodes, bothChangedIndexes = self.threeWayMerge(newSourceLines, baseLines, diffEngine)
+            movedLines = self.findMovedLines(oldLines, newSourceLines.getUncommentedLines(), opcodes, detectMoves)
+        return MergeResult(self, newSourceLines, opcodes, movedLines, baseLines is not None, bothChangedIndexes)
+    
+    # Two-way forward merge. Returns the MovedLines for the blocks of code lines found to have moved
+    # (if detectMoves is True), whose comments have been re-attached at their new location.
+    def mergeForwardTo(self, newSourceLines, outFile, diffEngine = None, detectMoves = True):
+        mergeResult = self.mergeResult(newSourceLines, diffEngine, detectMoves)
+        outFile.write(mergeResult.annotatedText())
+        return mergeResult.movedLines
+
+# One difflib-style opcode of a merge: lines i1:i2 of the old code lines becoming lines j1:j2 of the new ones
+# (counting code lines only, from 0)
+class MergeHunk:
+    
+    def __init__(self, tag, i1, i2, j1, j2, bothChanged = False):
+        self.tag = tag
+        self.i1 = i1
+        self.i2 = i2
+        self.j1 = j1
+        self.j2 = j2
+        self.bothChanged = bothChanged
+        
+    def __repr__(self):
+        return "MergeHunk(%r, %d, %d, %d, %d)" % (self.tag, self.i1, self.i2, self.j1, self.j2)
+
+def linesText(lines):
+    return "".join(["\n".join(lines), "\n"]) if len(lines) > 0 else ""
+
+# The result of a forward merge of newSourceLines into commentedLines, as a list of MergeHunks, which can be output
+# as the annotated commented file (with a header for each block, for a human to review), as the merged commented file
+# (if there are no conflicts), or as JSON. A hunk is a conflict if it deletes or replaces code lines holding comments
+# (other than lines which have moved), if the new source itself has comments in it, or (in a three-way merge)
+# if both the commented file and the main source have changed its lines since the base.
+class MergeResult:
+    
+    def __init__(self, commentedLines, newSourceLines, opcodes, movedLines, incremental = False, bothChangedIndexes = ()):
+        self.commentedLines = commentedLines
+        self.newSourceLines = newSourceLines
+        self.hunks = [MergeHunk(*opcode, bothChanged = index in bothChangedIndexes) for index, opcode in enumerate(opcodes)]
+        self.movedLines = movedLines
+        self.incremental = incremental
+        
+    def numChangedBlocks(self):
+        return sum(1 for hunk in self.hunks if hunk.tag != "equal")
+    
+    # The comments on the old lines of a hunk which would be lost if the hunk were applied
+    def heldComments(self, hunk):
+        comments = []
+        if hunk.tag in ["delete", "replace"]:
+            for i in range(hunk.i1, hunk.i2):
+                if i not in self.movedLines.newIndexes:
+                    comments.extend(self.commentedLines.getExtremeComments(i))
+        return comments
+    
+    def hasNewSourceComments(self, hunk):
+        return any(len(self.newSourceLines.getExtremeComments(j)) > 0 for j in range(hunk.j1, hunk.j2))
+    
+    def isConflict(self, hunk):
+        return hunk.bothChanged or len(self.heldComments(hunk)) > 0 or self.hasNewSourceComments(hunk)
+    
+    def conflicts(self):
+        return [hunk for hunk in self.hunks if self.isConflict(hunk)]
+    
+    def isClean(self):
+        return len(self.conflicts()) == 0
+    
+    # The commented file with a header before each block (except that a three-way merge only has headers 
+    # for changed blocks, and for the unchanged blocks following them)
+    def annotatedText(self):
+        outputLines = []
+        afterChangedBlock = False
+        for hunk in self.hunks:
+            if hunk.tag == "equal":
+                if afterChangedBlock or not self.incremental:
+                    outputLines.append(ExtremelyCommentedLines.blockHeaderTemplate % "EQUAL")
+                self.commentedLines.addEqualLines(self.newSourceLines, hunk.i1, hunk.i2, hunk.j1, hunk.j2, outputLines)
+            else:
+                self.commentedLines.addChangedBlock(self.newSourceLines, hunk.tag, hunk.i1, hunk.i2, hunk.j1, hunk.j2, 
+                                                    outputLines, self.movedLines)
+            afterChangedBlock = hunk.tag != "equal"
+        return linesText(outputLines)
+    
+    # The commented file with every hunk applied, and no headers (only meaningful if there are no conflicts)
+    def mergedText(self):
+        outputLines = []
+        for hunk in self.hunks:
+            if hunk.tag == "equal":
+                self.commentedLines.addEqualLines(self.newSourceLines, hunk.i1, hunk.i2, hunk.j1, hunk.j2, outputLines)
+            else:
+                self.commentedLines.addNewLines(self.newSourceLines, hunk.j1, hunk.j2, outputLines, self.movedLines)
+        return linesText(outputLines)
+    
+    def hunkJson(self, hunk):
+        hunkJson = {"kind": hunk.tag, "oldStart": hunk.i1, "oldEnd": hunk.i2, "newStart": hunk.j1, "newEnd": hunk.j2}
+        if hunk.tag == "equal":
+            hunkJson["numComments"] = sum(len(self.commentedLines.getExtremeComments(i)) for i in range(hunk.i1, hunk.i2))
+        else:
+            hunkJson["conflict"] = self.isConflict(hunk)
+            hunkJson["bothChanged"] = hunk.bothChanged
+            hunkJson["oldLines"] = [{"code": self.commentedLines.codeLines[i], 
+                                     "comments": self.commentedLines.getExtremeComments(i),
+                                     "movedTo": self.movedLines.newIndexes.get(i)}
+                                    for i in range(hunk.i1, hunk.i2)]
+            hunkJson["newLines"] = [{"code": self.newSourceLines.codeLines[j], 
+                                     "comments": self.newSourceLines.getExtremeComments(j),
+                                     "movedFrom": self.movedLines.oldIndexes.get(j)}
+                                    for j in range(hunk.j1, hunk.j2)]
+        return hunkJson
+    
+    def toJson(self):
+        return {"incremental": self.incremental,
+                "clean": self.isClean(),
+                "numChangedBlocks": self.numChangedBlocks(),
+                "numConflicts": len(self.conflicts()),
+                "movedBlocks": [list(movedBlock) for movedBlock in self.movedLines],
+                "hunks": [self.hunkJson(hunk) for hunk in self.hunks]}
                 
-def readExtremelyCommentedLines(fileName, extremeCommentLineSelector):
-    inputFile = open(fileName, "r")
-    extremelyCommentedLines = ExtremelyCommentedLines(extremeCommentLineSelector)
-    extremelyCommentedLines.addLines(inputFile)
-    inputFile.close()
+# (if commentClassifier isn't given, it is chosen for the file's language)
+def readExtremelyCommentedLines(fileName, commentClassifier = None):
+    with span("read"), open(fileName, "r") as inputFile:
+        text = inputFile.read()
+    if commentClassifier is None:
+        commentClassifier = commentClassifierForFile(fileName, text)
+    extremelyCommentedLines = ExtremelyCommentedLines(commentClassifier)
+    with span("classify"):
+        extremelyCommentedLines.addText(text)
     return extremelyCommentedLines
 
-pythonExtremeCommentRegex = re.compile("^\s*#[EN]\s.*$")
+mergeBlockHeaderRegex = re.compile(r'^## (EQUAL|DELETE|INSERT|REPLACE) #+$', re.MULTILINE)
 
-def pythonExtremeCommentsSelector(line):
-    return pythonExtremeCommentRegex.match(line)
+# Does the file contain merge block headers (i.e. is it forward merge output that hasn't yet been reviewed)?
+def hasMergeBlockHeaders(fileName):
+    with open(fileName, "r") as inputFile:
+        return mergeBlockHeaderRegex.search(inputFile.read()) is not None
 
-def main():
-    mainSourceFileName = "ExtremeDocHighlighting.py"
-    commentedSourceFileName = "ed/ExtremeDocHighlighting.py"
+# Raised instead of syncing a commented file which still has merge block headers
+# (whose headers, separators and old code lines would otherwise be treated as code)
+class UnreviewedMergeError(Exception):
+    pass
+
+def checkNoMergeBlockHeaders(commentedSourceFileName):
+    if hasMergeBlockHeaders(commentedSourceFileName):
+        raise UnreviewedMergeError("%s has unreviewed merge blocks" % commentedSourceFileName)
+
+# (baseId identifies where the bases for three-way merges come from, or is None for two-way merges)
+def forwardMergeFingerprint(diffEngineName, baseId, detectMoves, commentClassifier, autoApply = False):
+    return makeFingerprint("forward", diffEngineName, baseId, detectMoves, commentClassifier.regex.pattern, autoApply)
+
+def printMovedLines(commentedSourceLines, movedLines):
+    for i, j, size in movedLines:
+        numComments = sum(len(commentedSourceLines.getExtremeComments(k)) for k in range(i, i + size))
+        print(" moved code lines %d-%d to %d-%d, re-attaching %d comments." % (i + 1, i + size, j + 1, j + size, numComments))
+
+# Merge the main source forward into the commented source (which is both an input and the output),
+# skipped if neither has changed since the last recorded merge. Returns True if the commented source was changed,
+# False if it was unchanged, or None if the merge was skipped.
+# If baseSnapshots is given, and has a base for the commented source, the merge is three-way: it only marks
+# the blocks which have changed in the main source since that base, keeps code changed only in the commented source,
+# and marks blocks changed in both as bothChanged (which are conflicts).
+# If detectMoves is True, comments on blocks of code which have moved are re-attached where the code has moved to.
+# If autoApply is True, and the merge has no conflicts (see MergeResult), the commented source is written
+# already merged, without block headers (so it needs no review, and if baseSnapshots is given, the main source
+# is recorded as its new base). If resultFileName is given, the MergeResult is written to it as JSON.
+# Raises UnreviewedMergeError if the commented source still has merge block headers from an earlier merge.
+def mergeForwardFile(mainSourceFileName, commentedSourceFileName, 
+                     diffEngineName = DEFAULT_DIFF_ENGINE_NAME, buildCache = None, baseSnapshots = None, 
+                     detectMoves = True, autoApply = False, resultFileName = None):
+    #E merging again into unreviewed merge output would treat its block headers and old lines as code
+    checkNoMergeBlockHeaders(commentedSourceFileName)
+    inputFileNames = [mainSourceFileName, commentedSourceFileName]
+    if baseSnapshots is not None:
+        inputFileNames.extend(baseSnapshots.cacheInputFileNames(commentedSourceFileName))
+    #E both files are classified by the comment marker for the commented file's language
+    commentClassifier = commentClassifierForFile(commentedSourceFileName)
+    fingerprint = forwardMergeFingerprint(diffEngineName, None if baseSnapshots is None else baseSnapshots.baseId, 
+                                          detectMoves, commentClassifier, autoApply)
+    if buildCache is not None and buildCache.isUpToDate(commentedSourceFileName, inputFileNames, fingerprint):
+        print(" %s is up to date." % commentedSourceFileName)
+        return None
     
-    mainSourceLines = readExtremelyCommentedLines(mainSourceFileName, pythonExtremeCommentsSelector)
-    commentedSourceLines = readExtremelyCommentedLines(commentedSourceFileName, pythonExtremeCommentsSelector)
+    mainSourceLines = readExtremelyCommentedLines(mainSourceFileName, commentClassifier)
+    commentedSourceLines = readExtremelyCommentedLines(commentedSourceFileName, commentClassifier)
     
     #print("mainSourceLines = \n%s" % mainSourceLines)
     #print("commentedSourceLines = \n%s" % commentedSourceLines)
     
-    with open(commentedSourceFileName, "w") as outFile:
-        commentedSourceLines.mergeForwardTo(mainSourceLines, outFile)
+    baseLines = None if baseSnapshots is None else baseSnapshots.loadBaseLines(commentedSourceFileName)
+    
+    mergeResult = commentedSourceLines.mergeResult(mainSourceLines, getDiffEngine(diffEngineName), detectMoves, 
+                                                   baseLines)
+    applied = autoApply and mergeResult.isClean()
+    #E the output is written in one go, to a temporary file which then replaces the commented source
+    outputFile = ChangedOutputFile(commentedSourceFileName)
+    with span("write"), outputFile as outFile:
+        outFile.write(mergeResult.mergedText() if applied else mergeResult.annotatedText())
+    if outputFile.changed:
         print(" updated %s from %s." % (commentedSourceFileName, mainSourceFileName))
-        
-        
+    else:
+        print(" %s unchanged." % commentedSourceFileName)
+    if baseLines is not None:
+        print(" %d changed blocks since the base." % mergeResult.numChangedBlocks())
+    printMovedLines(commentedSourceLines, mergeResult.movedLines)
+    if applied:
+        print(" applied the merge, which has no conflicts.")
+        if baseSnapshots is not None:
+            baseSnapshots.recordBase(commentedSourceFileName, mainSourceFileName, mainSourceLines.getUncommentedLines())
+    elif autoApply:
+        print(" %d conflicting blocks need review." % len(mergeResult.conflicts()))
+    if resultFileName is not None:
+        with ChangedOutputFile(resultFileName) as resultFile:
+            json.dump(mergeResult.toJson(), resultFile, indent = 1)
+    if buildCache is not None:
+        buildCache.record(commentedSourceFileName, inputFileNames, fingerprint)
+    return outputFile.changed
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Merge changes in main source forward into the extremely commented source")
+    argParser.add_argument("--diff", choices = sorted(diffEngines), default = DEFAULT_DIFF_ENGINE_NAME,
+                           help = "line diff engine (default: %(default)s)")
+    argParser.add_argument("--no-cache", action = "store_true", help = "always merge, even if neither input has changed")
+    argParser.add_argument("--no-base", action = "store_true", 
+                           help = "always do a full two-way merge, instead of a three-way merge from the last synced base")
+    argParser.add_argument("--no-moves", action = "store_true", 
+                           help = "don't detect moved code (whose comments would then be left where the code was)")
+    argParser.add_argument("--auto-apply", action = "store_true", 
+                           help = "if no comments would be lost, write the merged file without block headers")
+    argParser.add_argument("--json", default = None, metavar = "FILE", help = "write the merge result to FILE as JSON")
+    addTimingArguments(argParser)
+    args = argParser.parse_args()
+    startTiming(args)
+    buildCache = None if args.no_cache else BuildCache()
+    baseSnapshots = None if args.no_base else BaseSnapshots()
+    
+    mainSourceFileName = "ExtremeDocHighlighting.py"
+    commentedSourceFileName = "ed/ExtremeDocHighlighting.py"
+    
+    try:
+        mergeForwardFile(mainSourceFileName, commentedSourceFileName, args.diff, buildCache, baseSnapshots, 
+                         not args.no_moves, args.auto_apply, args.json)
+    except UnreviewedMergeError as exception:
+        print(" not merging %s: %s" % (mainSourceFileName, exception))
+    if buildCache is not None:
+        buildCache.save()
     
 if __name__ == "__main__":
     main()
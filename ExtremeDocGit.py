@@ -0,0 +1,109 @@
+import os, json, subprocess
+
+from ExtremeDocCache import ChangedOutputFile
+
+# Incremental syncing using the local git repository (without any network access): finding which files have changed
+# since a given commit (or since the last recorded sync), so that only the affected files need to be processed,
+# and reading old versions of files from git, so that they can be used as bases for three-way forward merges.
+
+DEFAULT_SYNC_FILE_NAME = ".extreme-doc-sync.json"
+
+class GitError(Exception):
+    pass
+
+# Run a git command in the current directory, returning its output
+def runGit(*args):
+    process = subprocess.run(["git"] + list(args), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    if process.returncode != 0:
+        raise GitError("git %s failed: %s" % (" ".join(args), process.stderr.decode("utf-8", "replace").strip()))
+    return process.stdout
+
+# The full commit id for a ref (e.g. "HEAD~3" or a branch name)
+def resolveCommit(ref):
+    return runGit("rev-parse", "--verify", "%s^{commit}" % ref).decode("ascii").strip()
+
+# (or None if nothing has been committed yet)
+def headCommit():
+    try:
+        return resolveCommit("HEAD")
+    except GitError:
+        return None
+
+def nulSeparatedPaths(output):
+    return [os.path.normpath(path) for path in output.decode("utf-8").split("\0") if path != ""]
+
+# The paths (relative to the current directory) of all files under it which differ between the commit and
+# the working tree (including uncommitted and untracked files, and deleted files)
+def changedFilesSince(commit):
+    changedFiles = set(nulSeparatedPaths(runGit("diff", "--name-only", "--relative", "-z", commit, "--")))
+    changedFiles.update(nulSeparatedPaths(runGit("ls-files", "--others", "--exclude-standard", "-z")))
+    return changedFiles
+
+# The contents of a file (given relative to the current directory) as at the commit, or None if it didn't exist then
+def readFileAtCommit(commit, fileName):
+    try:
+        return runGit("show", "%s:./%s" % (commit, fileName.replace(os.sep, "/"))).decode("utf-8")
+    except GitError:
+        return None
+
+# The commit at which each tool last completed a sync, recorded as a JSON object with a key for each tool
+class SyncCommits:
+
+    def __init__(self, fileName = DEFAULT_SYNC_FILE_NAME):
+        self.fileName = fileName
+        self.commits = {}
+        if os.path.exists(fileName):
+            with open(fileName, "r") as syncFile:
+                self.commits = json.load(syncFile)
+
+    def lastSyncCommit(self, key):
+        return self.commits.get(key)
+
+    def recordSync(self, key, commit):
+        if commit is None:
+            return
+        self.commits[key] = commit
+        with ChangedOutputFile(self.fileName) as syncFile:
+            json.dump(self.commits, syncFile, indent = 1, sort_keys = True)
+
+# Bases for three-way forward merges, read from git: the base for a commented file is its main source file
+# as at the commit (with the same interface as ExtremeDocSnapshot.BaseSnapshots, but nothing is ever recorded)
+class GitBaseSnapshots:
+
+    def __init__(self, commit, mainRoot = ".", commentedRoot = "ed"):
+        self.commit = commit
+        self.mainRoot = mainRoot
+        self.commentedRoot = commentedRoot
+        self.baseId = "git:%s" % commit
+
+    def mainFileName(self, commentedFileName):
+        return os.path.normpath(os.path.join(self.mainRoot, os.path.relpath(commentedFileName, self.commentedRoot)))
+
+    # (the base is identified by the commit, which is part of baseId, so no files need to be checked)
+    def cacheInputFileNames(self, commentedFileName):
+        return []
+
+    def hasBase(self, commentedFileName):
+        return True
+
+    def recordBase(self, commentedFileName, mainFileName, mainCodeLines):
+        pass
+
+    def loadBaseLines(self, commentedFileName):
+        from ExtremeDocForwardMerge import ExtremelyCommentedLines
+        from ExtremeDocComments import commentClassifierForFile
+        mainText = readFileAtCommit(self.commit, self.mainFileName(commentedFileName))
+        if mainText is None:
+            return None
+        mainSourceLines = ExtremelyCommentedLines(commentClassifierForFile(commentedFileName))
+        mainSourceLines.addText(mainText)
+        return mainSourceLines.getUncommentedLines()
+
+# The commit to find changes since: sinceRef if given, else the last sync recorded under syncKey
+# if sinceLastSync is True (or None if there isn't one, or neither option was given)
+def sinceCommit(sinceRef, sinceLastSync, syncCommits, syncKey):
+    if sinceRef is not None:
+        return resolveCommit(sinceRef)
+    if sinceLastSync:
+        return syncCommits.lastSyncCommit(syncKey)
+    return None
@@ -1,186 +1,123 @@
-from pygments import highlight
-from pygments.filter import Filter
-from pygments.lexers import RubyLexer
-from pygments.token import Token, STANDARD_TYPES
-from pygments.formatters import HtmlFormatter
+import os
+import argparse
 
-import os, re
-from urllib.request import urlopen
-from io import StringIO
+from ExtremeDocCache import BuildCache, ChangedOutputFile, makeFingerprint
+from ExtremeDocLexers import getLexer, lexerNameForFile, lexTokens
+from ExtremeDocTokenCache import TokenCache
+from ExtremeDocTiming import timings, span, addTimingArguments, startTiming
 
-STANDARD_TYPES[Token.Comment.Negative] = "cn"
-STANDARD_TYPES[Token.Comment.Extreme] = "ce"
+# Stylesheets and scripts used by the generated pages (found in the asset directory,
+# which is also the base directory that relativeBaseDir leads back to)
+CSS_FILES = ["default.css", "extreme-doc.css"]
+JAVASCRIPT_FILES = ["extreme-doc.js"]
 
-JSQUERY_VERSION = "1.6.4"
-JSQUERY_URL = "http://ajax.googleapis.com/ajax/libs/jquery/%s/jquery.min.js" % JSQUERY_VERSION
-JSQUERY_FILENAME = "jquery.min.%s.js" % JSQUERY_VERSION
-JSQUERY_FILE_LOCATION = "js/%s" % JSQUERY_FILENAME
+# The Pygments-based classes live in ExtremeDocFormatting, and are only imported when first used
+def __getattr__(name):
+    if name in ["RelabelExtremeCommentsFilter", "HtmlPageFormatter"]:
+        import ExtremeDocFormatting
+        return getattr(ExtremeDocFormatting, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-#E A pygments filter which will relabel comments starting with "#N "/"#E " as being of type Token.Comment.Negative/Extreme
-class RelabelExtremeCommentsFilter(Filter):
-    def filter (self, lexer, stream):
-        for ttype, value in stream:
-            if ttype == Token.Comment.Single:
-                if value.startswith("#N "):
-                    yield Token.Comment.Negative, value[3:]
-                elif value.startswith ("#E "):
-                    yield Token.Comment.Extreme, value[3:]
-                else:
-                    yield ttype, value
-            else:
-                #print(" ttype = %s, value = %r" % (ttype, value))
-                yield ttype, value
-                
-# A sub-class of HtmlFormatter, which adds its own header/footer, and which post-processes the highlighted code
-# (HtmlFormatter has a header, but it doesn't have enough options for what we want)
-class HtmlPageFormatter(HtmlFormatter):
-    
-    def __init__(self, **options):
-        HtmlFormatter.__init__(self, **options)
-        self.relativeBaseDir = options.get("relativeBaseDir", "")
-    
-    def htmlStart(self):
-        return """%s
-<html>
-<head>
-<title>%s</title>
-%s
-%s
-<body>
-""" % (self.htmlDocType(), self.title, self.cssIncludes(), self.javascriptIncludes())
-    
-    def cssIncludes(self):
-        return "\n".join(["<link href = \"%s%s\" type = \"text/css\" rel = \"stylesheet\"/>" 
-                          % (self.relativeBaseDir, cssFile)
-                          for cssFile in self.cssFiles()])
-    
-    def javascriptIncludes(self):
-        return "\n".join(["<script src=\"%s%s\" type=\"text/javascript\"></script>" % 
-                          (self.relativeBaseDir, javascriptFile)
-                          for javascriptFile in self.javascriptFiles()])
-    
-    def cssFiles(self):
-        return ["default.css", "extreme-doc.css"]
-    
-    def javascriptFiles(self):
-        return [JSQUERY_FILE_LOCATION, "extreme-doc.js"]
+# The relative URL of baseDir from the directory containing fileName (e.g. "../" for "ed/ExtremeDocHighlighting.py")
+def relativeBaseDirFor(fileName, baseDir = "."):
+    relativeDir = os.path.relpath(os.path.dirname(os.path.abspath(fileName)), os.path.abspath(baseDir))
+    if relativeDir == ".":
+        return ""
+    return "../" * len(relativeDir.split(os.sep))
 
-    #E The HTML document type declaration    
-    def htmlDocType(self):
-        return "<!DOCTYPE html>"
-    
-    #E HTML that goes at the end of the page
-    def htmlEnd(self):
-        return "</body></html>\n"
+def highlightingFingerprint(lexerName, relativeBaseDir, cssFiles, javascriptFiles, selfContained, linesPerChunk):
+    return makeFingerprint("highlight", lexerName, relativeBaseDir, cssFiles, javascriptFiles, selfContained, linesPerChunk)
 
-    emptyLineRegex = re.compile(r'^(\s*)$')
-    cLineRegex = re.compile(r'^(\s*)(<span class="(c[ne])">(.*))$')
-    lineRegex = re.compile(r'^(\s*)(<span class="(.*))$')
-    
-    codeLineTemplate = "<div class=\"%s\"><code>%s%s</code></div>"
-    
-    def taggedCodeLine(self, indentWhitespace, line, tag):
-        return HtmlPageFormatter.codeLineTemplate % (tag, 
-                                                     indentWhitespace.replace(" ", "&nbsp"), 
-                                                     line)
-    
-    def divifiedSpanLine(self, spanLine):
-        match = HtmlPageFormatter.cLineRegex.match(spanLine)
-        if match:
-            return self.taggedCodeLine(match.group(1), match.group(2), "%s-line" % match.group(3))
-        else:
-            match = HtmlPageFormatter.emptyLineRegex.match(spanLine)
-            if match:
-                return self.taggedCodeLine(match.group(1), "", "line")
-            else:
-                match = HtmlPageFormatter.lineRegex.match(spanLine)
-                if match:
-                    return self.taggedCodeLine(match.group(1), match.group(2), "line")
-                else:
-                    raise Exception("Unexpected pygments line: %r" % spanLine)
+# Remove chunk pages left over from an earlier, longer version of a file (or an earlier chunk size)
+def removeStaleChunkFiles(htmlPageFormatter):
+    chunkNumber = len(htmlPageFormatter.chunks) + 1
+    while os.path.exists(htmlPageFormatter.chunkFileName(chunkNumber)):
+        os.remove(htmlPageFormatter.chunkFileName(chunkNumber))
+        chunkNumber += 1
 
-    firstLineRegex = re.compile(r'^(<div.*)<pre>(.*)$')
-    
-    lastLineRegex = re.compile(r'^(.*)</pre>(</div>)$')
-    
-    def writeDivifiedHtml(self, spannedHtml, outfile):
-        lines = spannedHtml.split("\n")
-        
-        firstLine = lines[0]
-        print("firstLine = %r" % firstLine)
-
-        firstLineMatch = HtmlPageFormatter.firstLineRegex.match(firstLine)
-        if firstLineMatch:
-            outfile.write("%s\n" % firstLineMatch.group(1))
-            outfile.write("%s\n" % self.divifiedSpanLine(firstLineMatch.group(2)))
-        else:
-            raise Exception("First line %r does not match expected pattern" % firstLine)
-        
-        for i in range(1, len(lines)-2):
-            #print(" line %r" % lines[i])
-            outfile.write("%s\n" % self.divifiedSpanLine(lines[i]))
-            
-        lastLine = lines[-2]
-        print("lastLine = %r" % lastLine)
-        
-        lastLineMatch = HtmlPageFormatter.lastLineRegex.match(lastLine)
-        if lastLineMatch:
-            outfile.write("%s\n" % self.divifiedSpanLine(lastLineMatch.group(1)))
-            outfile.write("%s\n" % lastLineMatch.group(2))
-        else:
-            raise Error("Last line %r does not match expected pattern" % lastLine)
-            
-        veryLastLine = lines[-1]
-        if veryLastLine != '':
-            raise Error("very last line %r is not empty" % veryLastLine)
-        
-    def format_unencoded(self, tokensource, outfile):
-        outfile.write(self.htmlStart())
-        stringBuffer = StringIO()
-        HtmlFormatter.format_unencoded(self, tokensource, stringBuffer)
-        highlightedHtml = stringBuffer.getvalue()
-        self.writeDivifiedHtml(highlightedHtml, outfile)
-        stringBuffer.close()
-        outfile.write(self.htmlEnd())
-
-def downloadUrlToFile(url, fileName, clobberIfThere = False):
-    print("Downloading %s to %s ..." % (url, fileName))
-    if clobberIfThere or not os.path.exists(fileName):
-        webFile = urlopen(url)
-        localFile = open(fileName, 'wb')
-        localFile.write(webFile.read())
-        webFile.close()
-        localFile.close()
-        print(" downloaded.")
-    else:
-        print (" not replacing existing file %s" % fileName)
-    
-def process(inputFileName, relativeBaseDir = ""):
-    
-    #E the output file name is the input file name with ".html" on the end
-    outputFileName = "%s.html" % inputFileName
-    #E use the Ruby lexer provided by Pygments to parse Ruby input files
-    rubyLexer = RubyLexer()
-    rubyLexer.add_filter(RelabelExtremeCommentsFilter())
-    htmlPageFormatter = HtmlPageFormatter(title = inputFileName, relativeBaseDir = relativeBaseDir)
-    
-    inputFile = open(inputFileName, "r")
-    code = inputFile.read()
-    inputFile.close()
+# Returns True if the output file was changed, False if it was unchanged, or None if it was already up to date
+# (lexerName is the Pygments name of the language, and if not given, is chosen from the file name or "#!" line).
+# If selfContained is True, the stylesheets and scripts are included in the page, instead of being linked to.
+# If linesPerChunk is more than 0, the lines are written to pages of that many lines each ("<input file>.1.html" etc.),
+# and the output file is an index of those pages.
+# The numbers of negative and extreme comment lines are recorded as details in buildCache's entry for the output file.
+# If tokenCache is given, the source is only lexed if its tokens aren't already in tokenCache.
+def process(inputFileName, relativeBaseDir = "", buildCache = None, lexerName = None, 
+            selfContained = False, assetDir = "", linesPerChunk = 0, outputFileName = None, tokenCache = None):
+    
+    #E by default, the output file name is the input file name with ".html" on the end
+    if outputFileName is None:
+        outputFileName = "%s.html" % inputFileName
+    
+    with span("read"):
+        inputFile = open(inputFileName, "r")
+        code = inputFile.read()
+        inputFile.close()
+    
+    if lexerName is None:
+        lexerName = lexerNameForFile(inputFileName, code)
+        if lexerName is None:
+            raise Exception("Don't know which language %s is in" % inputFileName)
+    
+    #E the page depends on the contents of its CSS and Javascript files (whether included or fingerprinted)
+    inputFileNames = [inputFileName] + [os.path.join(assetDir, assetFile) for assetFile in CSS_FILES + JAVASCRIPT_FILES]
+    fingerprint = highlightingFingerprint(lexerName, relativeBaseDir, CSS_FILES, JAVASCRIPT_FILES, selfContained, linesPerChunk)
+    if buildCache is not None and buildCache.isUpToDate(outputFileName, inputFileNames, fingerprint):
+        print("%s is up to date." % outputFileName)
+        return None
+    
+    from ExtremeDocFormatting import HtmlPageFormatter
+    #E the lexer (with its RelabelExtremeCommentsFilter) is shared by all files in the same language
+    lexer = getLexer(lexerName)
+    htmlPageFormatter = HtmlPageFormatter(title = inputFileName, relativeBaseDir = relativeBaseDir, 
+                                          cssFiles = CSS_FILES, javascriptFiles = JAVASCRIPT_FILES, 
+                                          selfContained = selfContained, assetDir = assetDir, 
+                                          linesPerChunk = linesPerChunk, 
+                                          chunkBaseName = outputFileName[:-len(".html")])
     
     print("pygmentizing %s into %s ..." % (inputFileName, outputFileName))
     
-    outputFile = open(outputFileName, "w")
-    
-    highlight(code, rubyLexer, htmlPageFormatter, outfile = outputFile)
-    outputFile.close()
+    outputFile = ChangedOutputFile(outputFileName)
+    with outputFile as outFile:
+        #E with timing on, the source is lexed and filtered before it is formatted, so that each stage is timed separately
+        #E (otherwise the tokens are streamed from the lexer to the formatter, as pygments.highlight does)
+        if tokenCache is not None:
+            tokens = tokenCache.getTokens(code, lexerName)
+        elif timings.enabled():
+            tokens = lexTokens(lexer, code)
+        else:
+            tokens = lexer.get_tokens(code)
+        with span("format"):
+            htmlPageFormatter.format(iter(tokens), outFile)
+    removeStaleChunkFiles(htmlPageFormatter)
+    if buildCache is not None:
+        buildCache.record(outputFileName, inputFileNames, fingerprint, 
+                          {"negativeComments": htmlPageFormatter.numNegativeComments, 
+                           "extremeComments": htmlPageFormatter.numExtremeComments})
+    return outputFile.changed
     
 def main():
-    downloadUrlToFile (JSQUERY_URL, JSQUERY_FILE_LOCATION, clobberIfThere = False)
+    argParser = argparse.ArgumentParser(description = "Generate highlighted HTML for a source file with extreme and negative comments")
+    argParser.add_argument("--no-cache", action = "store_true", help = "always regenerate, even if the input is unchanged")
+    argParser.add_argument("--lexer", default = None, 
+                           help = "Pygments name of the source language (default: chosen from the file extension or #! line)")
+    argParser.add_argument("--self-contained", action = "store_true", 
+                           help = "include the CSS and Javascript in the page, so it needs no other files")
+    argParser.add_argument("--lines-per-chunk", type = int, default = 0, 
+                           help = "split the page into pages of this many lines, with an index page (default: one page)")
+    argParser.add_argument("--no-token-cache", action = "store_true", help = "always lex the source, instead of re-using its tokens")
+    addTimingArguments(argParser)
+    args = argParser.parse_args()
+    startTiming(args)
+    buildCache = None if args.no_cache else BuildCache()
+    tokenCache = None if args.no_token_cache else TokenCache()
+    
     #inputFileName = "synqa.rb"
     inputFileName = "ed/ExtremeDocHighlighting.py"
-    process(inputFileName, "../")
+    process(inputFileName, "../", buildCache, args.lexer, args.self_contained, 
+            linesPerChunk = args.lines_per_chunk, tokenCache = tokenCache)
+    if buildCache is not None:
+        buildCache.save()
 
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
@@ -0,0 +1,84 @@
+import os, re
+
+from ExtremeDocTiming import span
+
+# A registry of the Pygments lexers used for highlighting, chosen by file extension (or by the
+# interpreter named in a "#!" line), with one configured lexer (including RelabelExtremeCommentsFilter)
+# kept for each language, so that it can be re-used for every file in that language.
+# Pygments itself is only imported when a lexer is first needed.
+
+# Pygments lexer names (aliases) for each supported file extension
+LEXER_NAMES_BY_EXTENSION = {
+    ".py": "python",
+    ".rb": "ruby",
+    ".sh": "bash",
+    ".pl": "perl",
+    ".js": "javascript",
+    ".c": "c",
+    ".h": "c",
+    ".cpp": "cpp",
+    ".java": "java",
+    ".el": "emacs-lisp",
+    ".lisp": "common-lisp",
+    ".sql": "sql",
+    ".hs": "haskell",
+    ".lua": "lua",
+}
+
+# Pygments lexer names for interpreters named in "#!" lines (with any version number removed)
+LEXER_NAMES_BY_INTERPRETER = {
+    "python": "python",
+    "ruby": "ruby",
+    "sh": "bash",
+    "bash": "bash",
+    "perl": "perl",
+    "node": "javascript",
+    "lua": "lua",
+}
+
+shebangRegex = re.compile(r'^#!\s*(\S+)(?:\s+(\S+))?')
+interpreterVersionRegex = re.compile(r'[0-9.]+$')
+
+def interpreterFromShebang(firstLine):
+    match = shebangRegex.match(firstLine)
+    if not match:
+        return None
+    interpreter = os.path.basename(match.group(1))
+    if interpreter == "env" and match.group(2) is not None:
+        interpreter = match.group(2)
+    return interpreterVersionRegex.sub("", interpreter)
+
+# The lexer name for a source file, from its extension, or else from the "#!" line at the start of code
+# (returns None if the language isn't known)
+def lexerNameForFile(fileName, code = ""):
+    lexerName = LEXER_NAMES_BY_EXTENSION.get(os.path.splitext(fileName)[1])
+    if lexerName is None and code.startswith("#!"):
+        lexerName = LEXER_NAMES_BY_INTERPRETER.get(interpreterFromShebang(code.split("\n", 1)[0]))
+    return lexerName
+
+def isHighlightableFile(fileName):
+    return os.path.splitext(fileName)[1] in LEXER_NAMES_BY_EXTENSION
+
+configuredLexers = {}
+
+# A Pygments lexer for the named language, with extreme and negative comments relabelled (created once per language)
+def getLexer(lexerName):
+    lexer = configuredLexers.get(lexerName)
+    if lexer is None:
+        from pygments.lexers import get_lexer_by_name
+        from ExtremeDocFormatting import RelabelExtremeCommentsFilter
+        from ExtremeDocComments import COMMENT_MARKERS_BY_LEXER, DEFAULT_COMMENT_MARKER
+        lexer = get_lexer_by_name(lexerName)
+        lexer.add_filter(RelabelExtremeCommentsFilter(
+            commentMarker = COMMENT_MARKERS_BY_LEXER.get(lexerName, DEFAULT_COMMENT_MARKER)))
+        configuredLexers[lexerName] = lexer
+    return lexer
+
+# The tokens of code from a configured lexer, as a list, with the lexing and the filtering timed as separate spans
+# (so all the tokens are lexed before any are filtered)
+def lexTokens(lexer, code):
+    from pygments.filter import apply_filters
+    with span("lex"):
+        tokens = list(lexer.get_tokens(code, unfiltered = True))
+    with span("filter"):
+        return list(apply_filters(tokens, lexer.filters, lexer))
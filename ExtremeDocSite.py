@@ -0,0 +1,219 @@
+import os, sys, time, shutil, filecmp, html
+import argparse
+
+from ExtremeDocHighlighting import process, relativeBaseDirFor, CSS_FILES, JAVASCRIPT_FILES
+from ExtremeDocLexers import LEXER_NAMES_BY_EXTENSION, lexerNameForFile
+from ExtremeDocTree import SyncResult, findSourceFiles, ensureDirectoryForFile, workerCacheEntries, poolResults, printSummary
+from ExtremeDocCache import BuildCache, ChangedOutputFile, fileHash
+from ExtremeDocTokenCache import TokenCache
+from ExtremeDocGit import SyncCommits, sinceCommit, changedFilesSince, headCommit
+from ExtremeDocTiming import timings, addTimingArguments, startTiming
+
+# Generate a static site of highlighted pages for a whole source tree: each highlightable file under the source root
+# becomes "<relative path>.html" under the site directory, with the pages generated across a process pool,
+# one shared copy of the CSS and Javascript files at the top of the site, and an index page
+# listing every file with its numbers of extreme and negative comments.
+
+INDEX_FILE_NAME = "index.html"
+
+# The outcome of highlighting one file, with the numbers of comment lines found in it
+class PageResult(SyncResult):
+
+    def __init__(self, relativePath, status, message = "", seconds = 0.0):
+        SyncResult.__init__(self, relativePath, status, message, seconds)
+        self.numNegativeComments = 0
+        self.numExtremeComments = 0
+
+def pageFileName(siteDir, relativePath):
+    return os.path.join(siteDir, "%s.html" % relativePath)
+
+# Copy the CSS and Javascript files into the site directory (only replacing copies that are different)
+def copyAssets(assetDir, siteDir):
+    for assetFile in CSS_FILES + JAVASCRIPT_FILES:
+        sourceFileName = os.path.join(assetDir, assetFile)
+        siteFileName = os.path.join(siteDir, assetFile)
+        if not (os.path.exists(siteFileName) and filecmp.cmp(sourceFileName, siteFileName, shallow = False)):
+            print("copying %s to %s" % (sourceFileName, siteFileName))
+            ensureDirectoryForFile(siteFileName)
+            shutil.copyfile(sourceFileName, siteFileName)
+
+# Highlight one file in a worker process. As in ExtremeDocTree.syncPair, the worker gets an in-memory BuildCache
+# holding just the entry for its page, and the updated entry is returned in the result. (The cache is used even
+# if caching is off, because the comment counts are recorded in the page's entry.)
+def highlightPage(task):
+    relativePath, sourceRoot, siteDir, cacheEntries, selfContained, linesPerChunk, tokenCache = task
+    startTime = time.time()
+    inputFileName = os.path.join(sourceRoot, relativePath)
+    outputFileName = pageFileName(siteDir, relativePath)
+    buildCache = BuildCache(None)
+    buildCache.entries = {} if cacheEntries is None else cacheEntries
+    try:
+        ensureDirectoryForFile(outputFileName)
+        changed = process(inputFileName, relativeBaseDirFor(outputFileName, siteDir), buildCache, None,
+                          selfContained, siteDir, linesPerChunk, outputFileName, tokenCache)
+        #E an up-to-date page from before comment counts were recorded has to be regenerated to get them
+        if buildCache.getDetails(outputFileName) is None:
+            buildCache.entries = {}
+            changed = process(inputFileName, relativeBaseDirFor(outputFileName, siteDir), buildCache, None,
+                              selfContained, siteDir, linesPerChunk, outputFileName, tokenCache)
+        if changed is None:
+            result = PageResult(relativePath, SyncResult.SKIPPED, "up to date")
+        else:
+            result = PageResult(relativePath, SyncResult.UPDATED if changed else SyncResult.UNCHANGED)
+        details = buildCache.getDetails(outputFileName)
+        result.numNegativeComments = details["negativeComments"]
+        result.numExtremeComments = details["extremeComments"]
+    except Exception as exception:
+        result = PageResult(relativePath, SyncResult.FAILED, "%s: %s" % (type(exception).__name__, exception))
+    if buildCache.modified:
+        result.cacheEntries = buildCache.entries
+    result.timingEvents = timings.takeEvents()
+    result.seconds = time.time() - startTime
+    return result
+
+# Highlight every file across a process pool, printing each result as it arrives, and return the results
+# in the order of relativePaths (if buildCache is given, pages whose inputs are unchanged are skipped,
+# and buildCache is updated, but not saved, and if tokenCache is given, sources whose tokens it has aren't lexed)
+def highlightPages(relativePaths, sourceRoot, siteDir, processes = None, buildCache = None,
+                   selfContained = False, linesPerChunk = 0, tokenCache = None):
+    tasks = [(relativePath, sourceRoot, siteDir, workerCacheEntries(buildCache, pageFileName(siteDir, relativePath)),
+              selfContained, linesPerChunk, tokenCache)
+             for relativePath in relativePaths]
+    resultsByPath = {}
+    for result in poolResults(highlightPage, tasks, processes):
+        print(result)
+        resultsByPath[result.relativePath] = result
+        if buildCache is not None:
+            for fileName, entry in result.cacheEntries.items():
+                buildCache.setEntry(fileName, entry)
+    return [resultsByPath[relativePath] for relativePath in relativePaths]
+
+# The result for a page whose source hasn't changed, with the comment counts recorded in buildCache
+# (or None if there is no page, or no counts for it)
+def unchangedPageResult(relativePath, siteDir, buildCache):
+    outputFileName = pageFileName(siteDir, relativePath)
+    details = None if buildCache is None else buildCache.getDetails(outputFileName)
+    if details is None or not os.path.exists(outputFileName):
+        return None
+    result = PageResult(relativePath, SyncResult.SKIPPED, "unchanged")
+    result.numNegativeComments = details["negativeComments"]
+    result.numExtremeComments = details["extremeComments"]
+    return result
+
+# Results for the pages whose sources (and the CSS and Javascript files) haven't changed (according to git),
+# as a dictionary by relative path
+def unchangedPageResults(relativePaths, sourceRoot, siteDir, assetDir, buildCache, changedFiles):
+    unchangedResults = {}
+    if any(os.path.normpath(os.path.join(assetDir, assetFile)) in changedFiles 
+           for assetFile in CSS_FILES + JAVASCRIPT_FILES):
+        return unchangedResults
+    for relativePath in relativePaths:
+        if os.path.normpath(os.path.join(sourceRoot, relativePath)) not in changedFiles:
+            result = unchangedPageResult(relativePath, siteDir, buildCache)
+            if result is not None:
+                unchangedResults[relativePath] = result
+    return unchangedResults
+
+# The names of the token files of the sources in a site build (found by reading the sources again,
+# since the sources of pages which were up to date weren't read)
+def usedTokenFileNames(relativePaths, sourceRoot, tokenCache):
+    for relativePath in relativePaths:
+        inputFileName = os.path.join(sourceRoot, relativePath)
+        try:
+            with open(inputFileName, "r") as inputFile:
+                code = inputFile.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        lexerName = lexerNameForFile(inputFileName, code)
+        if lexerName is not None:
+            yield tokenCache.tokenFileName(code, lexerName)
+
+def indexRowHtml(href, name, numNegativeComments, numExtremeComments):
+    return "<tr><td>%s</td><td>%d</td><td>%d</td></tr>\n" % (
+        name if href is None else "<a href=\"%s\">%s</a>" % (html.escape(href), name),
+        numNegativeComments, numExtremeComments)
+
+# Write the index page, linking to every page that was generated, with its numbers of comment lines
+def writeIndexPage(siteDir, title, results, selfContained = False):
+    indexFileName = os.path.join(siteDir, INDEX_FILE_NAME)
+    pageResults = [result for result in results if result.status != SyncResult.FAILED]
+    with ChangedOutputFile(indexFileName) as indexFile:
+        indexFile.write("<!DOCTYPE html>\n<html>\n<head>\n<title>%s</title>\n" % html.escape(title))
+        if not selfContained:
+            for cssFile in CSS_FILES:
+                indexFile.write("<link href = \"%s?v=%s\" type = \"text/css\" rel = \"stylesheet\"/>\n" %
+                                (cssFile, fileHash(os.path.join(siteDir, cssFile))[:12]))
+        indexFile.write("</head>\n<body>\n<h1>%s</h1>\n" % html.escape(title))
+        indexFile.write("<table class=\"chunkIndex\">\n")
+        indexFile.write("<tr><th>File</th><th>Negative comments</th><th>Extreme comments</th></tr>\n")
+        for result in pageResults:
+            relativeUrl = "%s.html" % result.relativePath.replace(os.sep, "/")
+            indexFile.write(indexRowHtml(relativeUrl, html.escape(result.relativePath),
+                                         result.numNegativeComments, result.numExtremeComments))
+        indexFile.write(indexRowHtml(None, "Total (%d files)" % len(pageResults),
+                                     sum(result.numNegativeComments for result in pageResults),
+                                     sum(result.numExtremeComments for result in pageResults)))
+        indexFile.write("</table>\n</body></html>\n")
+    print("wrote index of %d pages to %s" % (len(pageResults), indexFileName))
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Generate a site of highlighted pages for every source file in a tree")
+    argParser.add_argument("--source-root", default = "ed", help = "root of the source tree to highlight (default: %(default)s)")
+    argParser.add_argument("--site-dir", default = "site", help = "directory to write the site into (default: %(default)s)")
+    argParser.add_argument("--asset-dir", default = ".",
+                           help = "directory containing the CSS and Javascript files (default: %(default)s)")
+    argParser.add_argument("--title", default = None, help = "title of the index page (default: the source root)")
+    argParser.add_argument("--processes", type = int, default = None, help = "number of worker processes (default: one per CPU)")
+    argParser.add_argument("--no-cache", action = "store_true", help = "regenerate every page, even if its inputs are unchanged")
+    argParser.add_argument("--self-contained", action = "store_true",
+                           help = "include the CSS and Javascript in every page, instead of sharing one copy")
+    argParser.add_argument("--lines-per-chunk", type = int, default = 0,
+                           help = "split each page into pages of this many lines (default: one page per file)")
+    argParser.add_argument("--since", default = None, metavar = "REF",
+                           help = "only highlight files changed since git commit REF (the others are taken from the cache)")
+    argParser.add_argument("--since-last-sync", action = "store_true",
+                           help = "like --since, from the commit at the last site build done with --since or --since-last-sync")
+    argParser.add_argument("--no-token-cache", action = "store_true", help = "always lex the sources, instead of re-using their tokens")
+    addTimingArguments(argParser)
+    args = argParser.parse_args()
+    startTiming(args)
+    buildCache = None if args.no_cache else BuildCache()
+    tokenCache = None if args.no_token_cache else TokenCache()
+
+    startTime = time.time()
+    copyAssets(args.asset_dir, args.site_dir)
+    relativePaths = findSourceFiles(args.source_root, excludedDirs = [args.site_dir],
+                                    extensions = list(LEXER_NAMES_BY_EXTENSION))
+    unchangedResults = {}
+    gitMode = args.since is not None or args.since_last_sync
+    if gitMode:
+        syncCommits = SyncCommits()
+        syncCommit = headCommit()
+        commit = sinceCommit(args.since, args.since_last_sync, syncCommits, "site")
+        if commit is not None:
+            unchangedResults = unchangedPageResults(relativePaths, args.source_root, args.site_dir, args.asset_dir, 
+                                                    buildCache, changedFilesSince(commit))
+            print("%d files unchanged since commit %s" % (len(unchangedResults), commit[:12]))
+    changedPaths = [relativePath for relativePath in relativePaths if relativePath not in unchangedResults]
+    print("highlighting %d files from %s into %s ..." % (len(changedPaths), args.source_root, args.site_dir))
+    changedResults = highlightPages(changedPaths, args.source_root, args.site_dir, args.processes, buildCache,
+                                    args.self_contained, args.lines_per_chunk, tokenCache)
+    resultsByPath = dict(unchangedResults)
+    resultsByPath.update((result.relativePath, result) for result in changedResults)
+    results = [resultsByPath[relativePath] for relativePath in relativePaths]
+    writeIndexPage(args.site_dir, args.title or args.source_root, results, args.self_contained)
+    if buildCache is not None:
+        buildCache.save()
+    #E the token cache only keeps the tokens of the current sources, so it doesn't grow with every edit
+    if tokenCache is not None:
+        numRemoved = tokenCache.removeUnusedTokenFiles(usedTokenFileNames(relativePaths, args.source_root, tokenCache))
+        if numRemoved > 0:
+            print("removed %d unused token files from %s" % (numRemoved, tokenCache.cacheDir))
+    printSummary("highlighted", results, time.time() - startTime)
+    if any(result.status == SyncResult.FAILED for result in results):
+        sys.exit(1)
+    if gitMode:
+        syncCommits.recordSync("site", syncCommit)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import os, hashlib
+
+from ExtremeDocComments import splitLines
+
+# Base snapshots for three-way forward merges. Whenever a commented file and its main source file are known
+# to be in sync (e.g. just after a backward merge), the code lines of the main source are saved as the base
+# for the commented file. The next forward merge can then diff both the new main source and the commented file's
+# code lines against the base, taking the main source's changes, keeping the commented file's own changes,
+# and only flagging the lines changed in both.
+
+DEFAULT_BASE_DIR = ".extreme-doc-base"
+
+class BaseSnapshots:
+
+    # (identifies where bases come from, in the fingerprints of merges which use them)
+    baseId = "snapshots"
+
+    def __init__(self, baseDir = DEFAULT_BASE_DIR):
+        self.baseDir = baseDir
+
+    # Snapshots are stored at the commented file's path (relative to the current directory) under baseDir
+    def snapshotFileName(self, commentedFileName):
+        absolutePath = os.path.abspath(commentedFileName)
+        relativePath = os.path.relpath(absolutePath)
+        if relativePath.startswith(os.pardir):
+            relativePath = os.path.join("_external", "%s_%s" % (hashlib.sha1(absolutePath.encode("utf-8")).hexdigest()[:16],
+                                                                os.path.basename(absolutePath)))
+        return os.path.join(self.baseDir, relativePath)
+
+    # The files a merge using the base for commentedFileName depends on
+    def cacheInputFileNames(self, commentedFileName):
+        return [self.snapshotFileName(commentedFileName)]
+
+    def hasBase(self, commentedFileName):
+        return os.path.exists(self.snapshotFileName(commentedFileName))
+
+    # Record the main source file (whose code lines are mainCodeLines) as the base for commentedFileName
+    def recordBase(self, commentedFileName, mainFileName, mainCodeLines):
+        snapshotFileName = self.snapshotFileName(commentedFileName)
+        snapshotDir = os.path.dirname(snapshotFileName)
+        if not os.path.isdir(snapshotDir):
+            os.makedirs(snapshotDir)
+        with open("%s.tmp" % snapshotFileName, "w") as snapshotFile:
+            snapshotFile.write("".join("%s\n" % line for line in mainCodeLines))
+        os.replace("%s.tmp" % snapshotFileName, snapshotFileName)
+
+    # The code lines of the base for commentedFileName (or None if no base has been recorded)
+    def loadBaseLines(self, commentedFileName):
+        snapshotFileName = self.snapshotFileName(commentedFileName)
+        if not os.path.exists(snapshotFileName):
+            return None
+        with open(snapshotFileName, "r") as snapshotFile:
+            return splitLines(snapshotFile.read())
@@ -0,0 +1,145 @@
+import os, json, time, atexit
+from contextlib import contextmanager
+
+# Stage-level timing of the tools, as named spans (see SPAN_NAMES): the merges time reading, classifying, diffing
+# and writing, and highlighting times lexing, filtering, formatting, and turning each line into a <div> ("divify").
+# With the timing mode off (the default), a span costs one check of the mode. Otherwise each span is recorded as
+# an event, and when the tool exits, the events are either summarised as a table of the total time in each span
+# ("summary"), or written as a JSON trace ("trace", in the Trace Event format read by chrome://tracing and Perfetto).
+# Worker processes record their own events, which are sent back to the parent process with their results.
+# Separately, the main process can be run under cProfile, with its stats dumped to a file.
+
+OFF = "off"
+SUMMARY = "summary"
+TRACE = "trace"
+
+TIMING_MODES = [OFF, SUMMARY, TRACE]
+
+SPAN_NAMES = ["read", "classify", "diff", "write", "lex", "filter", "format", "divify"]
+
+# The default timing mode can be set in the environment, so that it applies to tools run by other tools
+TIMING_MODE_VARIABLE = "EXTREME_DOC_TIMING"
+
+DEFAULT_TRACE_FILE_NAME = "extreme-doc-trace.json"
+
+# The events recorded in this process, each as (name, start time (from time.time), seconds, number of calls, pid)
+class StageTimings:
+
+    def __init__(self, mode = OFF):
+        self.mode = mode
+        self.events = []
+
+    def enabled(self):
+        return self.mode != OFF
+
+    def record(self, name, startTime, seconds, calls = 1):
+        self.events.append((name, startTime, seconds, calls, os.getpid()))
+
+    # Remove and return the events recorded so far (e.g. to send them back from a worker process)
+    def takeEvents(self):
+        events = self.events
+        self.events = []
+        return events
+
+    def addEvents(self, events):
+        self.events.extend(events)
+
+    # The total seconds and number of calls for each span name (in the order of SPAN_NAMES, then any others)
+    def totals(self):
+        totalsByName = {}
+        for name, startTime, seconds, calls, pid in self.events:
+            total = totalsByName.setdefault(name, [0.0, 0])
+            total[0] += seconds
+            total[1] += calls
+        names = [name for name in SPAN_NAMES if name in totalsByName]
+        names.extend(sorted(name for name in totalsByName if name not in SPAN_NAMES))
+        return [(name, totalsByName[name][0], totalsByName[name][1]) for name in names]
+
+    def printSummary(self):
+        print("%-10s %10s %12s %12s" % ("span", "calls", "total (s)", "mean (ms)"))
+        for name, seconds, calls in self.totals():
+            print("%-10s %10d %12.3f %12.3f" % (name, calls, seconds, 1000.0 * seconds / calls if calls > 0 else 0.0))
+
+    def traceJson(self):
+        return {"traceEvents": [{"name": name, "cat": "extreme-doc", "ph": "X", "pid": pid, "tid": pid,
+                                 "ts": int(startTime * 1000000), "dur": int(seconds * 1000000),
+                                 "args": {"calls": calls}}
+                                for name, startTime, seconds, calls, pid in self.events],
+                "displayTimeUnit": "ms"}
+
+    def writeTrace(self, fileName):
+        with open(fileName, "w") as traceFile:
+            json.dump(self.traceJson(), traceFile)
+
+timings = StageTimings(os.environ.get(TIMING_MODE_VARIABLE, OFF))
+
+# (also used as the initializer of worker pools, so that workers time in the same mode,
+# without any events inherited from the parent process)
+def configureTiming(mode):
+    timings.mode = mode
+    timings.events = []
+
+@contextmanager
+def span(name):
+    if timings.mode == OFF:
+        yield
+        return
+    startTime = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.record(name, startTime, time.perf_counter() - start)
+
+# A span for work done a small piece at a time (e.g. one call per line), which yields a version of function
+# that adds the time of each call to the span, recorded as one event when the with block ends
+# (so a trace shows it as one event, from the start of the block, with the total time of the calls)
+@contextmanager
+def accumulatedSpan(name, function):
+    if timings.mode == OFF:
+        yield function
+        return
+    startTime = time.time()
+    total = [0.0, 0]
+    def timedFunction(*args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            total[0] += time.perf_counter() - start
+            total[1] += 1
+    try:
+        yield timedFunction
+    finally:
+        timings.record(name, startTime, total[0], total[1])
+
+def addTimingArguments(argParser):
+    argParser.add_argument("--timing", choices = TIMING_MODES, default = timings.mode,
+                           help = "time the stages of the tool, printing a summary table when it exits, or writing "
+                           + "a JSON trace (default: %(default)s, or $" + TIMING_MODE_VARIABLE + ")")
+    argParser.add_argument("--trace-file", default = DEFAULT_TRACE_FILE_NAME,
+                           help = "file to write the trace to, with --timing trace (default: %(default)s)")
+    argParser.add_argument("--profile", default = None, metavar = "FILE",
+                           help = "run the tool under cProfile, dumping its stats to FILE (worker processes aren't profiled)")
+
+# Start timing (and profiling) as given by the arguments added by addTimingArguments, with the report
+# (and the profile) written when the tool exits (including by sys.exit)
+def startTiming(args):
+    configureTiming(args.timing)
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    atexit.register(finishTiming, args, profiler)
+
+def finishTiming(args, profiler):
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print("wrote profile to %s" % args.profile)
+    if timings.mode == SUMMARY:
+        timings.printSummary()
+    elif timings.mode == TRACE:
+        timings.writeTrace(args.trace_file)
+        print("wrote %d trace events to %s" % (len(timings.events), args.trace_file))
@@ -0,0 +1,181 @@
+import os, sys, json, struct, hashlib
+from array import array
+
+from ExtremeDocCache import TOOL_VERSION
+from ExtremeDocLexers import getLexer, lexTokens
+from ExtremeDocTiming import span, timings
+
+# An on-disk cache of the token streams produced by the configured lexers (i.e. after RelabelExtremeCommentsFilter),
+# so that a page can be re-rendered (e.g. after a change to the page template or the formatter options)
+# without lexing its source again. Each stream is stored in its own file, named by a hash of the source,
+# the lexer name, the Pygments version and TOOL_VERSION, in a compact binary form which can be written
+# as the tokens are streamed from the lexer to the formatter:
+#
+#   MAGIC, the text of all the tokens, concatenated (UTF-8), the token type index of each token, the length
+#   of each token (both as arrays of little-endian unsigned integers, of the smallest size that fits),
+#   the header (JSON, with the list of token types used, the number of tokens and the array typecodes),
+#   and then the length of the text in bytes (8 bytes) and the length of the header (4 bytes).
+#
+# Token files not used by a site build are removed at the end of it (see removeUnusedTokenFiles).
+
+DEFAULT_TOKEN_CACHE_DIR = ".extreme-doc-tokens"
+
+MAGIC = b"EDTOKENS3\n"
+
+TRAILER_FORMAT = "<QI"
+
+# The typecode of the smallest unsigned integer array which can hold maxValue
+def arrayTypeCode(maxValue):
+    for typeCode in ["B", "H", "I", "L", "Q"]:
+        if maxValue < (1 << (8 * array(typeCode).itemsize)):
+            return typeCode
+    raise ValueError("%d is too large for an array" % maxValue)
+
+def toLittleEndianBytes(values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def fromLittleEndianBytes(typeCode, data):
+    values = array(typeCode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+def tokenTypeName(ttype):
+    return ".".join(ttype)
+
+def tokenTypeFromName(name):
+    from pygments.token import Token
+    ttype = Token
+    for part in name.split("."):
+        if part != "":
+            ttype = getattr(ttype, part)
+    return ttype
+
+# Yield each of tokens, while writing them to a token file, which is only completed (replacing any existing file)
+# if all the tokens are consumed. The text is written as it comes, and only the type index and length of each token
+# are kept until the end.
+def writingTokens(fileName, tokens):
+    typeIndexesByType = {}
+    typeNames = []
+    typeIndexes = array("L")
+    lengths = array("L")
+    #E (workers highlighting files with the same contents could be writing the same token file at the same time)
+    tempFileName = "%s.%d.tmp" % (fileName, os.getpid())
+    completed = False
+    try:
+        with open(tempFileName, "wb") as tokenFile:
+            tokenFile.write(MAGIC)
+            textLength = 0
+            for ttype, value in tokens:
+                typeIndex = typeIndexesByType.get(ttype)
+                if typeIndex is None:
+                    typeIndex = typeIndexesByType[ttype] = len(typeNames)
+                    typeNames.append(tokenTypeName(ttype))
+                typeIndexes.append(typeIndex)
+                lengths.append(len(value))
+                valueBytes = value.encode("utf-8")
+                tokenFile.write(valueBytes)
+                textLength += len(valueBytes)
+                yield ttype, value
+            typeIndexArray = array(arrayTypeCode(len(typeNames)), typeIndexes)
+            lengthArray = array(arrayTypeCode(max(lengths, default = 0)), lengths)
+            header = json.dumps({"types": typeNames, "numTokens": len(lengths), 
+                                 "typeIndexTypeCode": typeIndexArray.typecode, 
+                                 "lengthTypeCode": lengthArray.typecode}).encode("utf-8")
+            tokenFile.write(toLittleEndianBytes(typeIndexArray))
+            tokenFile.write(toLittleEndianBytes(lengthArray))
+            tokenFile.write(header)
+            tokenFile.write(struct.pack(TRAILER_FORMAT, textLength, len(header)))
+        os.replace(tempFileName, fileName)
+        completed = True
+    finally:
+        if not completed and os.path.exists(tempFileName):
+            os.remove(tempFileName)
+
+# An iterator over the (token type, value) pairs stored in a file (or None if the file isn't a valid token file)
+def readTokens(fileName):
+    with open(fileName, "rb") as tokenFile:
+        data = tokenFile.read()
+    trailerSize = struct.calcsize(TRAILER_FORMAT)
+    if not data.startswith(MAGIC) or len(data) < len(MAGIC) + trailerSize:
+        return None
+    textLength, headerLength = struct.unpack_from(TRAILER_FORMAT, data, len(data) - trailerSize)
+    headerEnd = len(data) - trailerSize
+    header = json.loads(data[headerEnd - headerLength:headerEnd].decode("utf-8"))
+    position = len(MAGIC) + textLength
+    text = data[len(MAGIC):position].decode("utf-8")
+    numTokens = header["numTokens"]
+    arrays = []
+    for typeCode in [header["typeIndexTypeCode"], header["lengthTypeCode"]]:
+        size = numTokens * array(typeCode).itemsize
+        arrays.append(fromLittleEndianBytes(typeCode, data[position:position + size]))
+        position += size
+    typeIndexes, lengths = arrays
+    if position != headerEnd - headerLength or sum(lengths) != len(text):
+        return None
+    ttypes = [tokenTypeFromName(typeName) for typeName in header["types"]]
+    return iterTokens(ttypes, typeIndexes, lengths, text)
+
+def iterTokens(ttypes, typeIndexes, lengths, text):
+    start = 0
+    for typeIndex, length in zip(typeIndexes, lengths):
+        end = start + length
+        yield ttypes[typeIndex], text[start:end]
+        start = end
+
+class TokenCache:
+
+    def __init__(self, cacheDir = DEFAULT_TOKEN_CACHE_DIR):
+        self.cacheDir = cacheDir
+
+    def tokenFileName(self, code, lexerName):
+        import pygments
+        hasher = hashlib.sha1(json.dumps([TOOL_VERSION, pygments.__version__, lexerName]).encode("utf-8"))
+        hasher.update(code.encode("utf-8"))
+        key = hasher.hexdigest()
+        return os.path.join(self.cacheDir, key[:2], key[2:])
+
+    # The filtered tokens of code from the named lexer, as an iterator, read from the cache if they are in it,
+    # otherwise streamed from the lexer, and saved in the cache as they are consumed
+    def getTokens(self, code, lexerName):
+        tokenFileName = self.tokenFileName(code, lexerName)
+        if os.path.exists(tokenFileName):
+            try:
+                with span("read"):
+                    tokens = readTokens(tokenFileName)
+            except (ValueError, KeyError, struct.error):
+                tokens = None
+            if tokens is not None:
+                return tokens
+        lexer = getLexer(lexerName)
+        #E with timing on, the tokens are lexed and filtered up front, so that each stage is timed separately
+        tokens = lexTokens(lexer, code) if timings.enabled() else lexer.get_tokens(code)
+        tokenDir = os.path.dirname(tokenFileName)
+        if not os.path.isdir(tokenDir):
+            os.makedirs(tokenDir)
+        return writingTokens(tokenFileName, tokens)
+
+    # Remove the token files other than those named in keptFileNames (e.g. the token files of the sources
+    # in a site build), and any directories left empty, returning the number of files removed.
+    # (Files whose names aren't token file names, such as the temporary files of other writers, are left alone.)
+    def removeUnusedTokenFiles(self, keptFileNames):
+        keptFileNames = set(os.path.normpath(fileName) for fileName in keptFileNames)
+        numRemoved = 0
+        if not os.path.isdir(self.cacheDir):
+            return numRemoved
+        for subDirName in os.listdir(self.cacheDir):
+            subDir = os.path.join(self.cacheDir, subDirName)
+            if len(subDirName) != 2 or not os.path.isdir(subDir):
+                continue
+            for fileName in os.listdir(subDir):
+                tokenFileName = os.path.normpath(os.path.join(subDir, fileName))
+                if len(fileName) == 38 and tokenFileName not in keptFileNames:
+                    os.remove(tokenFileName)
+                    numRemoved += 1
+            if len(os.listdir(subDir)) == 0:
+                os.rmdir(subDir)
+        return numRemoved
@@ -0,0 +1,257 @@
+import os, sys, time
+import argparse
+from multiprocessing import Pool
+
+from ExtremeDocForwardMerge import mergeForwardFile, hasMergeBlockHeaders, UnreviewedMergeError
+from ExtremeDocBackwardMerge import copyFileFilteredIfChanged
+from ExtremeDocDiff import diffEngines, DEFAULT_DIFF_ENGINE_NAME
+from ExtremeDocCache import BuildCache, cacheKey
+from ExtremeDocSnapshot import BaseSnapshots
+from ExtremeDocComments import COMMENTED_EXTENSIONS
+from ExtremeDocGit import SyncCommits, GitBaseSnapshots, sinceCommit, changedFilesSince, headCommit
+from ExtremeDocTiming import timings, configureTiming, addTimingArguments, startTiming
+
+# Whole-tree versions of the forward and backward merges, where the commented tree (e.g. "ed/")
+# mirrors the main source tree, and each file in one is paired with the file at the same relative path in the other.
+
+SOURCE_EXTENSIONS = COMMENTED_EXTENSIONS
+
+# A main source file and its extremely commented copy
+class SourcePair:
+
+    def __init__(self, relativePath, mainRoot, commentedRoot):
+        self.relativePath = relativePath
+        self.mainFileName = os.path.join(mainRoot, relativePath)
+        self.commentedFileName = os.path.join(commentedRoot, relativePath)
+
+    def __repr__(self):
+        return "SourcePair(%r)" % self.relativePath
+
+# The outcome of syncing one pair, as sent back from a worker process
+class SyncResult:
+
+    UPDATED = "updated"
+    UNCHANGED = "unchanged"
+    SKIPPED = "skipped"
+    CONFLICTED = "conflicted"
+    FAILED = "failed"
+    
+    STATUSES = [UPDATED, UNCHANGED, SKIPPED, CONFLICTED, FAILED]
+
+    def __init__(self, relativePath, status, message = "", seconds = 0.0):
+        self.relativePath = relativePath
+        self.status = status
+        self.message = message
+        self.seconds = seconds
+        self.cacheEntries = {}
+        self.timingEvents = []
+
+    def __str__(self):
+        return " %-10s %s (%.3fs)%s" % (self.status, self.relativePath, self.seconds,
+                                       ": %s" % self.message if self.message else "")
+
+# Run worker on each of tasks across a process pool (or in this process, if processes is 1), yielding each result
+# as it arrives, after adding the timing events it was sent back with (if timing is on) to timings.
+# Tasks are sent to the workers in batches of batchSize. The pool is closed when the results end (or are abandoned).
+def poolResults(worker, tasks, processes = None, batchSize = 1):
+    if processes == 1:
+        resultsIterator = map(worker, tasks)
+        pool = None
+    else:
+        pool = Pool(processes, configureTiming, (timings.mode,))
+        resultsIterator = pool.imap_unordered(worker, tasks, batchSize)
+    try:
+        for result in resultsIterator:
+            timings.addEvents(result.timingEvents)
+            yield result
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+# Print the number of results with each of statuses, e.g. "checked 10 files: 9 in sync, 1 drifted, ... in 0.12s"
+def printSummary(description, results, seconds, statuses = SyncResult.STATUSES):
+    counts = dict((status, 0) for status in statuses)
+    for result in results:
+        counts[result.status] += 1
+    print("%s %d files: %s in %.2fs" %
+          (description, len(results), ", ".join("%d %s" % (counts[status], status) for status in statuses), seconds))
+
+def isSourceFileName(fileName, extensions = SOURCE_EXTENSIONS):
+    return os.path.splitext(fileName)[1] in extensions
+
+# Relative paths of all source files under root (ignoring hidden directories, and anything under excludedDirs)
+def findSourceFiles(root, excludedDirs = [], extensions = SOURCE_EXTENSIONS):
+    excludedDirs = [os.path.abspath(excludedDir) for excludedDir in excludedDirs]
+    relativePaths = []
+    for dirPath, dirNames, fileNames in os.walk(root):
+        dirNames[:] = sorted(dirName for dirName in dirNames
+                             if not dirName.startswith(".")
+                             and os.path.abspath(os.path.join(dirPath, dirName)) not in excludedDirs)
+        for fileName in sorted(fileNames):
+            if isSourceFileName(fileName, extensions):
+                relativePaths.append(os.path.relpath(os.path.join(dirPath, fileName), root))
+    return relativePaths
+
+# All pairs for source files in the commented tree (the commented tree is the mirror,
+# so main source files which have no commented copy are not included)
+def findSourcePairs(mainRoot, commentedRoot, extensions = SOURCE_EXTENSIONS):
+    return [SourcePair(relativePath, mainRoot, commentedRoot)
+            for relativePath in findSourceFiles(commentedRoot, extensions = extensions)]
+
+# The pairs where either file is one of changedFiles (normalised paths relative to the current directory)
+def changedPairs(pairs, changedFiles):
+    return [pair for pair in pairs
+            if os.path.normpath(pair.mainFileName) in changedFiles or os.path.normpath(pair.commentedFileName) in changedFiles]
+
+def ensureDirectoryForFile(fileName):
+    dirName = os.path.dirname(fileName)
+    if dirName != "" and not os.path.isdir(dirName):
+        os.makedirs(dirName)
+
+def syncResultForChange(pair, changed):
+    if changed is None:
+        return SyncResult(pair.relativePath, SyncResult.SKIPPED, "up to date")
+    else:
+        return SyncResult(pair.relativePath, SyncResult.UPDATED if changed else SyncResult.UNCHANGED)
+
+# The merge result JSON file for a pair (in resultsDir, which mirrors the commented tree)
+def resultFileName(resultsDir, pair):
+    if resultsDir is None:
+        return None
+    fileName = os.path.join(resultsDir, "%s.json" % pair.relativePath)
+    ensureDirectoryForFile(fileName)
+    return fileName
+
+# (if autoApply is True, a commented file left with merge block headers, which needs review, is reported as conflicted,
+# and a commented file which already had them isn't merged, and is reported as conflicted by syncPair)
+def mergeForwardPair(pair, diffEngineName = DEFAULT_DIFF_ENGINE_NAME, buildCache = None, baseSnapshots = None,
+                     detectMoves = True, autoApply = False, resultsDir = None):
+    if not os.path.exists(pair.mainFileName):
+        return SyncResult(pair.relativePath, SyncResult.SKIPPED, "no main source file %s" % pair.mainFileName)
+    result = syncResultForChange(pair, mergeForwardFile(pair.mainFileName, pair.commentedFileName, 
+                                                        diffEngineName, buildCache, baseSnapshots, detectMoves,
+                                                        autoApply, resultFileName(resultsDir, pair)))
+    if autoApply and hasMergeBlockHeaders(pair.commentedFileName):
+        result.status = SyncResult.CONFLICTED
+        result.message = "merge needs review"
+    return result
+
+def copyBackwardPair(pair, buildCache = None, baseSnapshots = None):
+    ensureDirectoryForFile(pair.mainFileName)
+    return syncResultForChange(pair, copyFileFilteredIfChanged(pair.commentedFileName, pair.mainFileName, 
+                                                               buildCache, baseSnapshots))
+
+def outputFileName(direction, pair):
+    return pair.commentedFileName if direction == "forward" else pair.mainFileName
+
+# Run one pair in a worker, so that one failing file doesn't stop the whole tree being processed.
+# The worker gets its own in-memory BuildCache holding just the entry for its output file (if caching is on),
+# and the updated entries are returned in the result, to be saved by the parent process
+# (as are the timing events recorded by the worker, if timing is on).
+def syncPair(task):
+    direction, pair, diffEngineName, cacheEntries, baseSnapshots, detectMoves, autoApply, resultsDir = task
+    startTime = time.time()
+    buildCache = None
+    if cacheEntries is not None:
+        buildCache = BuildCache(None)
+        buildCache.entries = cacheEntries
+    try:
+        if direction == "forward":
+            result = mergeForwardPair(pair, diffEngineName, buildCache, baseSnapshots, detectMoves, autoApply, resultsDir)
+        else:
+            result = copyBackwardPair(pair, buildCache, baseSnapshots)
+    except UnreviewedMergeError as exception:
+        result = SyncResult(pair.relativePath, SyncResult.CONFLICTED, str(exception))
+    except Exception as exception:
+        result = SyncResult(pair.relativePath, SyncResult.FAILED, "%s: %s" % (type(exception).__name__, exception))
+    if buildCache is not None and buildCache.modified:
+        result.cacheEntries = buildCache.entries
+    result.timingEvents = timings.takeEvents()
+    result.seconds = time.time() - startTime
+    return result
+
+def workerCacheEntries(buildCache, fileName):
+    if buildCache is None:
+        return None
+    entry = buildCache.getEntry(fileName)
+    return {} if entry is None else {cacheKey(fileName): entry}
+
+# Sync every pair in the given direction ("forward" or "backward") across a process pool,
+# printing each result as it arrives, and return the list of results
+# (if buildCache is given, pairs whose inputs are unchanged are skipped, and buildCache is updated, but not saved,
+# and if baseSnapshots is given, backward merges record bases, and forward merges are three-way where possible)
+def syncTree(direction, pairs, processes = None, diffEngineName = DEFAULT_DIFF_ENGINE_NAME, buildCache = None,
+             baseSnapshots = None, detectMoves = True, autoApply = False, resultsDir = None):
+    tasks = [(direction, pair, diffEngineName, workerCacheEntries(buildCache, outputFileName(direction, pair)),
+              baseSnapshots, detectMoves, autoApply, resultsDir)
+             for pair in pairs]
+    results = []
+    for result in poolResults(syncPair, tasks, processes):
+        print(result)
+        results.append(result)
+        if buildCache is not None:
+            for fileName, entry in result.cacheEntries.items():
+                buildCache.setEntry(fileName, entry)
+    return results
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Forward or backward merge every file in a mirrored commented tree")
+    argParser.add_argument("direction", choices = ["forward", "backward"],
+                           help = "forward: main source into commented tree, backward: commented tree into main source")
+    argParser.add_argument("--main-root", default = ".", help = "root of main source tree (default: %(default)s)")
+    argParser.add_argument("--commented-root", default = "ed", help = "root of commented tree (default: %(default)s)")
+    argParser.add_argument("--processes", type = int, default = None, help = "number of worker processes (default: one per CPU)")
+    argParser.add_argument("--diff", choices = sorted(diffEngines), default = DEFAULT_DIFF_ENGINE_NAME,
+                           help = "line diff engine for forward merges (default: %(default)s)")
+    argParser.add_argument("--no-cache", action = "store_true", help = "process every pair, even if its inputs are unchanged")
+    argParser.add_argument("--no-base", action = "store_true", 
+                           help = "don't record bases, or do three-way forward merges from them")
+    argParser.add_argument("--no-moves", action = "store_true", help = "don't detect moved code in forward merges")
+    argParser.add_argument("--auto-apply", action = "store_true", 
+                           help = "write forward merges with no conflicts without block headers, and exit with status 2 "
+                           + "if any merges need review")
+    argParser.add_argument("--results-dir", default = None, 
+                           help = "write the result of each forward merge as JSON to <results dir>/<relative path>.json")
+    argParser.add_argument("--since", default = None, metavar = "REF",
+                           help = "only sync pairs with a file changed since git commit REF, using the main source "
+                           + "at REF as the base for three-way forward merges")
+    argParser.add_argument("--since-last-sync", action = "store_true",
+                           help = "like --since, from the commit at the last sync in this direction done with --since "
+                           + "or --since-last-sync (or sync every pair if there wasn't one)")
+    addTimingArguments(argParser)
+    args = argParser.parse_args()
+    startTiming(args)
+    buildCache = None if args.no_cache else BuildCache()
+    baseSnapshots = None if args.no_base else BaseSnapshots()
+
+    startTime = time.time()
+    pairs = findSourcePairs(args.main_root, args.commented_root)
+    #E in git mode, the commit to record as synced is the one at the start (so later commits will be looked at next time)
+    gitMode = args.since is not None or args.since_last_sync
+    if gitMode:
+        syncCommits = SyncCommits()
+        syncCommit = headCommit()
+        commit = sinceCommit(args.since, args.since_last_sync, syncCommits, args.direction)
+        if commit is None:
+            print("no %s sync has been recorded, so syncing every pair ..." % args.direction)
+        else:
+            pairs = changedPairs(pairs, changedFilesSince(commit))
+            print("%d pairs changed since commit %s" % (len(pairs), commit[:12]))
+            if args.direction == "forward" and baseSnapshots is not None:
+                baseSnapshots = GitBaseSnapshots(commit, args.main_root, args.commented_root)
+    print("%s syncing %d files between %s and %s ..." % (args.direction, len(pairs), args.main_root, args.commented_root))
+    results = syncTree(args.direction, pairs, args.processes, args.diff, buildCache, baseSnapshots, not args.no_moves,
+                       args.auto_apply, args.results_dir)
+    if buildCache is not None:
+        buildCache.save()
+    printSummary("%s sync of" % args.direction, results, time.time() - startTime)
+    if any(result.status == SyncResult.FAILED for result in results):
+        sys.exit(1)
+    if gitMode:
+        syncCommits.recordSync(args.direction, syncCommit)
+    if any(result.status == SyncResult.CONFLICTED for result in results):
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import os, time, importlib
+import argparse
+
+from ExtremeDocForwardMerge import mergeForwardFile, UnreviewedMergeError
+from ExtremeDocBackwardMerge import copyFileFilteredIfChanged
+from ExtremeDocHighlighting import process, relativeBaseDirFor
+from ExtremeDocLexers import getLexer, lexerNameForFile, isHighlightableFile
+from ExtremeDocTree import findSourceFiles, ensureDirectoryForFile
+from ExtremeDocDiff import diffEngines, DEFAULT_DIFF_ENGINE_NAME
+from ExtremeDocCache import BuildCache
+from ExtremeDocSnapshot import BaseSnapshots
+from ExtremeDocTiming import addTimingArguments, startTiming
+
+# A long-running process which polls the main source tree and the commented tree, and when a file is saved,
+# runs just the sync needed for that file: a forward merge if the main source changed, or a backward merge
+# if the commented copy changed, followed by re-highlighting the commented copy. Since the process
+# stays running, Pygments and the lexers are only loaded once.
+
+MAIN = "main"
+COMMENTED = "commented"
+
+def fileState(fileName):
+    try:
+        stat = os.stat(fileName)
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+class TreeWatcher:
+
+    def __init__(self, mainRoot = ".", commentedRoot = "ed", buildCache = None, baseSnapshots = None,
+                 diffEngineName = DEFAULT_DIFF_ENGINE_NAME, highlight = True,
+                 pollSeconds = 0.2, debounceSeconds = 0.1):
+        self.mainRoot = mainRoot
+        self.commentedRoot = commentedRoot
+        self.buildCache = buildCache
+        self.baseSnapshots = baseSnapshots
+        self.diffEngineName = diffEngineName
+        self.highlight = highlight
+        self.pollSeconds = pollSeconds
+        self.debounceSeconds = debounceSeconds
+        self.fileStates = {}
+        # relative paths whose main source changed while the commented file had unreviewed merge blocks
+        self.pendingForwardMerges = set()
+
+    def fileName(self, tree, relativePath):
+        return os.path.join(self.mainRoot if tree == MAIN else self.commentedRoot, relativePath)
+
+    # The state of every source file in both trees, keyed by (tree, relativePath)
+    def scan(self):
+        fileStates = {}
+        for relativePath in findSourceFiles(self.mainRoot, excludedDirs = [self.commentedRoot]):
+            fileStates[(MAIN, relativePath)] = fileState(self.fileName(MAIN, relativePath))
+        for relativePath in findSourceFiles(self.commentedRoot):
+            fileStates[(COMMENTED, relativePath)] = fileState(self.fileName(COMMENTED, relativePath))
+        return fileStates
+
+    def changedFiles(self, fileStates):
+        return sorted(key for key, state in fileStates.items()
+                      if state is not None and self.fileStates.get(key) != state)
+
+    # Wait until a scan shows some changed files, and then until there have been no further changes
+    # for debounceSeconds (so that a burst of saves is handled as one batch)
+    def waitForChanges(self):
+        fileStates = self.scan()
+        while len(self.changedFiles(fileStates)) == 0:
+            time.sleep(self.pollSeconds)
+            fileStates = self.scan()
+        while True:
+            time.sleep(self.debounceSeconds)
+            newFileStates = self.scan()
+            if newFileStates == fileStates:
+                break
+            fileStates = newFileStates
+        changedFiles = self.changedFiles(fileStates)
+        self.fileStates = fileStates
+        return changedFiles
+
+    # Note the new state of a file this process has just written, so it isn't treated as a new change
+    def noteWritten(self, tree, relativePath):
+        self.fileStates[(tree, relativePath)] = fileState(self.fileName(tree, relativePath))
+
+    def highlightCommented(self, relativePath):
+        commentedFileName = self.fileName(COMMENTED, relativePath)
+        if self.highlight and isHighlightableFile(commentedFileName):
+            process(commentedFileName, relativeBaseDirFor(commentedFileName), self.buildCache)
+
+    def syncChangedFile(self, tree, relativePath):
+        mainFileName = self.fileName(MAIN, relativePath)
+        commentedFileName = self.fileName(COMMENTED, relativePath)
+        if tree == MAIN:
+            if os.path.exists(commentedFileName):
+                try:
+                    mergeForwardFile(mainFileName, commentedFileName, self.diffEngineName, self.buildCache, self.baseSnapshots)
+                except UnreviewedMergeError:
+                    print(" not merging %s into %s yet: it has unreviewed merge blocks" % (mainFileName, commentedFileName))
+                    self.pendingForwardMerges.add(relativePath)
+                    return
+                self.noteWritten(COMMENTED, relativePath)
+                self.highlightCommented(relativePath)
+        else:
+            try:
+                if relativePath in self.pendingForwardMerges:
+                    #E the main source has changed since the merge that was reviewed, so those changes are merged forward
+                    #E (for review), instead of being overwritten by copying the commented file back
+                    mergeForwardFile(mainFileName, commentedFileName, self.diffEngineName, self.buildCache, self.baseSnapshots)
+                    self.pendingForwardMerges.discard(relativePath)
+                    print(" merged the later changes to %s into %s" % (mainFileName, commentedFileName))
+                    self.noteWritten(COMMENTED, relativePath)
+                else:
+                    ensureDirectoryForFile(mainFileName)
+                    copyFileFilteredIfChanged(commentedFileName, mainFileName, self.buildCache, self.baseSnapshots)
+                    self.noteWritten(MAIN, relativePath)
+            except UnreviewedMergeError:
+                print(" not copying %s back to %s: it has unreviewed merge blocks" % (commentedFileName, mainFileName))
+            self.highlightCommented(relativePath)
+
+    # The relative paths whose main and commented files have both changed in the same batch (e.g. after a git pull
+    # or a checkout), which aren't synced in either direction, since either sync would overwrite the other's changes
+    def conflictingPaths(self, changedFiles):
+        changedTrees = {}
+        for tree, relativePath in changedFiles:
+            changedTrees.setdefault(relativePath, set()).add(tree)
+        return set(relativePath for relativePath, trees in changedTrees.items() if len(trees) == 2)
+
+    # Load Pygments, and a lexer for each language in the commented tree, before the first save
+    def warmUp(self):
+        if self.highlight:
+            importlib.import_module("ExtremeDocFormatting")
+            lexerNames = set(lexerNameForFile(relativePath) for tree, relativePath in self.fileStates if tree == COMMENTED)
+            for lexerName in lexerNames:
+                if lexerName is not None:
+                    getLexer(lexerName)
+
+    def run(self):
+        self.fileStates = self.scan()
+        self.warmUp()
+        print("watching %s and %s (%d files) ..." % (self.mainRoot, self.commentedRoot, len(self.fileStates)))
+        while True:
+            changedFiles = self.waitForChanges()
+            startTime = time.time()
+            conflictingPaths = self.conflictingPaths(changedFiles)
+            for tree, relativePath in changedFiles:
+                print("%s changed" % self.fileName(tree, relativePath))
+                if relativePath in conflictingPaths:
+                    if tree == COMMENTED:
+                        print(" not syncing %s or %s: both have changed, so they need to be merged by hand"
+                              % (self.fileName(MAIN, relativePath), self.fileName(COMMENTED, relativePath)))
+                    continue
+                try:
+                    self.syncChangedFile(tree, relativePath)
+                except Exception as exception:
+                    print(" failed: %s: %s" % (type(exception).__name__, exception))
+            if self.buildCache is not None:
+                self.buildCache.save()
+            print(" synced %d changed files in %.3fs" % (len(changedFiles), time.time() - startTime))
+
+def main():
+    argParser = argparse.ArgumentParser(description = "Watch the main and commented trees, and sync and highlight each file as it is saved")
+    argParser.add_argument("--main-root", default = ".", help = "root of main source tree (default: %(default)s)")
+    argParser.add_argument("--commented-root", default = "ed", help = "root of commented tree (default: %(default)s)")
+    argParser.add_argument("--diff", choices = sorted(diffEngines), default = DEFAULT_DIFF_ENGINE_NAME,
+                           help = "line diff engine for forward merges (default: %(default)s)")
+    argParser.add_argument("--no-highlight", action = "store_true", help = "only merge, don't highlight")
+    argParser.add_argument("--no-cache", action = "store_true", help = "don't use or update the build cache")
+    argParser.add_argument("--no-base", action = "store_true", 
+                           help = "don't record bases, or do three-way forward merges from them")
+    argParser.add_argument("--poll", type = float, default = 0.2, help = "seconds between scans (default: %(default)s)")
+    argParser.add_argument("--debounce", type = float, default = 0.1,
+                           help = "seconds without further changes before syncing (default: %(default)s)")
+    addTimingArguments(argParser)
+    args = argParser.parse_args()
+    startTiming(args)
+    buildCache = None if args.no_cache else BuildCache()
+    baseSnapshots = None if args.no_base else BaseSnapshots()
+
+    watcher = TreeWatcher(args.main_root, args.commented_root, buildCache, baseSnapshots, args.diff, not args.no_highlight,
+                          args.poll, args.debounce)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print("stopped watching.")
+        if buildCache is not None:
+            buildCache.save()
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,30 @@
-$(document).ready(function() {
+document.addEventListener("DOMContentLoaded", function() {
     addHideShowCheckboxes();
-    setNegativeCommentsVisible(false);
-    setExtremeCommentsVisible(false);
   });
 
+function setCommentsVisible(bodyClass, visible) {
+  document.body.classList.toggle(bodyClass, visible);
+}
+
 function setNegativeCommentsVisible(visible) {
-  var displayProperty = visible ? "block" : "none";
-  $(".cn-line").css("display", displayProperty);
+  setCommentsVisible("show-negative-comments", visible);
 }
 
 function setExtremeCommentsVisible(visible) {
-  var displayProperty = visible ? "block" : "none";
-  $(".ce-line").css("display", displayProperty);
+  setCommentsVisible("show-extreme-comments", visible);
 }
 
 function addHideShowCheckboxes() {
-  $("body").prepend("<div><span class = 'showCommentsCheckboxes'>" + 
-                    "<span class = 'checkbox'>Show negative comments<input id = 'showNegatives' type = 'checkbox'>" + 
-                    "</span>" + 
-                    "<span class = 'checkbox'>Show extreme comments<input id = 'showExtremes' type = 'checkbox'>" + 
-                    "</span></span></div>");
-  $("#showNegatives").change(function(event) {
+  document.body.insertAdjacentHTML("afterbegin", 
+                                   "<div><span class = 'showCommentsCheckboxes'>" + 
+                                   "<span class = 'checkbox'>Show negative comments<input id = 'showNegatives' type = 'checkbox'>" + 
+                                   "</span>" + 
+                                   "<span class = 'checkbox'>Show extreme comments<input id = 'showExtremes' type = 'checkbox'>" + 
+                                   "</span></span></div>");
+  document.getElementById("showNegatives").addEventListener("change", function(event) {
       setNegativeCommentsVisible(event.target.checked);
     });
-  $("#showExtremes").change(function(event) {
+  document.getElementById("showExtremes").addEventListener("change", function(event) {
       setExtremeCommentsVisible(event.target.checked);
     });
 }